@@ -7,15 +7,48 @@ import asyncio
 import os
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from functools import lru_cache
+from statistics import fmean
+from typing import Dict, List, Optional, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import hashlib
+import numpy as np
 
 load_dotenv()
 
+# communitydata fields read when building snapshots and permanent timeline updates
+_COMMUNITY_SNAPSHOT_PROJECTION = {
+    "listing_id": 1,
+    "scraped_at": 1,
+    "community_data.communities.community_id": 1,
+    "community_data.communities.name": 1,
+    "community_data.communities.price": 1,
+    "community_data.communities.price_currency": 1,
+    "community_data.communities.build_status": 1,
+    "community_data.communities.build_type": 1,
+    "community_data.communities.accommodationCategory": 1,
+    "community_data.communities.offeredBy": 1,
+    "community_data.communities.address": 1
+}
+
+
+def _day_start(date: datetime) -> datetime:
+    """Midnight of the snapshot's day; a price already recorded since then is a same-day repeat"""
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _is_repeat_snapshot(previous_date, previous_price: float, price: float, date: datetime) -> bool:
+    """
+    Client-side twin of the is_repeat check in _build_timeline_update_pipeline: the last timeline
+    entry was recorded today at this price (string dates never match), so nothing is appended.
+    """
+    return isinstance(previous_date, datetime) and previous_price == price and previous_date >= _day_start(date)
+
+
 class PriceTracker:
     # Configurable timeframes for future expansion
     DEFAULT_MOVING_AVG_TIMEFRAMES = [7, 30, 90]
@@ -25,6 +58,17 @@ class PriceTracker:
     EXTENDED_TIMEFRAMES = [1, 3, 7, 14, 30, 60, 90, 180, 365]
     QUARTERLY_TIMEFRAMES = [1, 7, 30, 90, 180, 270, 365]
     
+    # Community documents fetched and snapshotted per round-trip
+    SNAPSHOT_BATCH_SIZE = 500
+    # Snapshot batches whose reads/writes may be in flight at once while the cursor keeps streaming
+    SNAPSHOT_BATCH_CONCURRENCY = 4
+    # Aggregated cities (each carrying every property timeline) held in memory at once
+    CITY_BATCH_SIZE = 50
+    # Maximum operations sent in a single bulk_write call
+    BULK_WRITE_BATCH_SIZE = 1000
+    # Most recent entries kept inline in price_timeline; the full history lives in price_timeline_raw
+    PRICE_TIMELINE_MAX_ENTRIES = 365
+    
     def __init__(self, use_extended_timeframes: bool = False):
         self.client = None
         self.db = None
@@ -32,6 +76,7 @@ class PriceTracker:
         self.communitydata_collection = None
         self.price_history_permanent_collection = None
         self.price_city_snapshot_collection = None
+        self.price_timeline_raw_collection = None
         
         # Set timeframes based on configuration
         if use_extended_timeframes:
@@ -45,13 +90,15 @@ class PriceTracker:
         """Async MongoDB connection"""
         try:
             uri = os.getenv("MONGO_DB_URI")
-            self.client = AsyncIOMotorClient(uri)
+            # Compress the wire protocol (timeline arrays dominate transfer); zlib is the no-dependency fallback
+            self.client = AsyncIOMotorClient(uri, compressors="zstd,zlib", zlibCompressionLevel=3)
             self.db = self.client['newhomesource']
             
             self.homepagedata_collection = self.db['homepagedata']
             self.communitydata_collection = self.db['communitydata']
             self.price_history_permanent_collection = self.db['price_history_permanent']
             self.price_city_snapshot_collection = self.db['price_city_snapshot']
+            self.price_timeline_raw_collection = self.db['price_timeline_raw']
             
             # Create indexes for performance
             await self._create_indexes()
@@ -67,21 +114,30 @@ class PriceTracker:
         try:
             
             # Permanent price history indexes
-            await self.price_history_permanent_collection.create_index([("permanent_property_id", 1)])
+            # permanent_property_id is stored as _id, so upserts hit the default _id index
             await self.price_history_permanent_collection.create_index([("original_listing_id", 1)])
             await self.price_history_permanent_collection.create_index([("property_snapshot.location.county", 1)])
             
-            # City price snapshot indexes
-            await self.price_city_snapshot_collection.create_index([("city_id", 1)])
+            # City price snapshot indexes (city_id is stored as _id)
             await self.price_city_snapshot_collection.create_index([("addressLocality", 1)])
             await self.price_city_snapshot_collection.create_index([("county", 1)])
             
+            # Full timeline history, one document per price event
+            await self.price_timeline_raw_collection.create_index([("permanent_property_id", 1), ("date", 1)])
+            
+            # Source community lookups by listing_id (timeline updates, archiving) and snapshot status filter
+            await self.communitydata_collection.create_index([("listing_id", 1)])
+            await self.communitydata_collection.create_index([("listing_status", 1)])
+            await self.db['communitydata_archived'].create_index([("listing_id", 1)])
+            
             logging.info("✅ Price tracking indexes created")
         except Exception as e:
             logging.warning(f"⚠️ Index creation warning: {e}")
     
-    def generate_permanent_id(self, community_id: str) -> str:
-        """Generate immutable permanent ID from community_id"""
+    @staticmethod
+    @lru_cache(maxsize=100_000)
+    def generate_permanent_id(community_id: str) -> str:
+        """Generate immutable permanent ID from community_id (memoized; the same IDs recur several times per run)"""
         return hashlib.md5(community_id.encode()).hexdigest()
     
     async def capture_price_snapshots_from_stage2(self):
@@ -90,42 +146,47 @@ class PriceTracker:
         Called from Stage 2 completion
         """
         try:
-            # Get all active community data (not just today's)
-            active_docs = await self.communitydata_collection.find({
-                "listing_status": {"$in": ["active", "new", "updated"]}
-            }).to_list(length=None)
-            
-            
-            logging.info(f"📊 Processing {len(active_docs)} active community documents for daily price snapshots")
-            
-            if len(active_docs) == 0:
+            # Stream all active community data (not just today's) in fixed-size batches
+            cursor = self.communitydata_collection.find(
+                {"listing_status": {"$in": ["active", "new", "updated"]}},
+                _COMMUNITY_SNAPSHOT_PROJECTION
+            ).batch_size(self.SNAPSHOT_BATCH_SIZE)
+            
+            stats = {"docs": 0, "communities": 0, "snapshots": 0}
+            buffer = []
+            batch_slots = asyncio.Semaphore(self.SNAPSHOT_BATCH_CONCURRENCY)
+            batch_tasks = []
+            
+            async def run_batch(docs: List[Dict]):
+                try:
+                    await self._process_snapshot_batch(docs, stats)
+                finally:
+                    batch_slots.release()
+            
+            async for doc in cursor:
+                buffer.append(doc)
+                if len(buffer) >= self.SNAPSHOT_BATCH_SIZE:
+                    # Wait for a free slot, then let this batch's Mongo round-trips overlap the next fetch
+                    await batch_slots.acquire()
+                    batch_tasks.append(asyncio.create_task(run_batch(buffer)))
+                    buffer = []
+            
+            if buffer:
+                await batch_slots.acquire()
+                batch_tasks.append(asyncio.create_task(run_batch(buffer)))
+            
+            await asyncio.gather(*batch_tasks)
+            
+            if stats["docs"] == 0:
                 logging.info("ℹ️ No active community data found - skipping price snapshot capture")
                 return
-                
-            price_snapshots = []
-            total_communities_processed = 0
-            
-            for doc in active_docs:
-                listing_id = doc.get("listing_id")
-                if not listing_id:
-                    continue
-                
-                communities = doc.get("community_data", {}).get("communities", [])
-                total_communities_processed += len(communities)
-                
-                for community in communities:
-                    snapshot = await self._create_price_snapshot(community, listing_id, doc)
-                    if snapshot:
-                        price_snapshots.append(snapshot)
             
             # Log processing summary
-            logging.info(f"🏠 Analyzed {total_communities_processed} individual communities from {len(active_docs)} properties")
-            logging.info(f"📈 Created {len(price_snapshots)} price snapshots for permanent storage")
+            logging.info(f"🏠 Analyzed {stats['communities']} individual communities from {stats['docs']} properties")
+            logging.info(f"📈 Created {stats['snapshots']} price snapshots for permanent storage")
             
-            # Update permanent storage for active properties
-            if price_snapshots:
-                await self._update_permanent_timelines(price_snapshots)
-                logging.info(f"✅ Successfully processed {len(price_snapshots)} price snapshots")
+            if stats["snapshots"]:
+                logging.info(f"✅ Successfully processed {stats['snapshots']} price snapshots")
                 
                 # Create city price snapshots after updating permanent storage
                 await self._create_city_price_snapshots()
@@ -136,30 +197,91 @@ class PriceTracker:
         except Exception as e:
             logging.error(f"❌ Error capturing price snapshots: {e}")
     
-    async def _create_price_snapshot(self, community: Dict, listing_id: str, source_doc: Dict) -> Optional[Dict]:
+    async def _process_snapshot_batch(self, docs: List[Dict], stats: Dict):
+        """
+        Create price snapshots for a batch of community documents and write them to permanent storage.
+        
+        Input: docs (List[Dict]) - communitydata documents, stats (Dict) - running totals updated in place
+        """
+        price_snapshots = []
+        docs_by_listing_id = {doc["listing_id"]: doc for doc in docs if doc.get("listing_id")}
+        
+        # Fetch previous prices for every community in the batch with one $in query
+        permanent_records = await self._preload_permanent_records([
+            self.generate_permanent_id(community["community_id"])
+            for doc in docs
+            for community in doc.get("community_data", {}).get("communities", [])
+            if community.get("community_id")
+        ])
+        
+        # One snapshot date for the whole batch instead of a clock read per community
+        snapshot_date = datetime.now()
+        
+        for doc in docs:
+            listing_id = doc.get("listing_id")
+            if not listing_id:
+                continue
+            
+            communities = doc.get("community_data", {}).get("communities", [])
+            stats["communities"] += len(communities)
+            
+            for community in communities:
+                snapshot = await self._create_price_snapshot(community, listing_id, doc, permanent_records, snapshot_date)
+                if snapshot:
+                    price_snapshots.append(snapshot)
+        
+        stats["docs"] += len(docs)
+        stats["snapshots"] += len(price_snapshots)
+        
+        # Update permanent storage for active properties; the batch already holds their community docs
+        if price_snapshots:
+            await self._update_permanent_timelines(price_snapshots, docs_by_listing_id)
+    
+    async def _preload_permanent_records(self, permanent_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Load existing permanent records for a set of permanent IDs in one query.
+        
+        Input: permanent_ids (List[str]) - permanent IDs (stored as _id)
+        Output: Dict[str, Dict] - permanent records keyed by permanent ID
+        """
+        if not permanent_ids:
+            return {}
+        
+        records = {}
+        # Only the last timeline entry is needed for the previous price, so don't ship the whole array
+        async for record in self.price_history_permanent_collection.find(
+            {"_id": {"$in": list(set(permanent_ids))}},
+            {"price_timeline": {"$slice": -1}}
+        ).batch_size(self.SNAPSHOT_BATCH_SIZE):
+            records[record["_id"]] = record
+        return records
+    
+    async def _create_price_snapshot(self, community: Dict, listing_id: str, source_doc: Dict,
+                                     permanent_records: Dict[str, Dict],
+                                     snapshot_date: Optional[datetime] = None) -> Optional[Dict]:
         """Create individual price snapshot with change detection"""
         try:
             community_name = community.get('name', 'Unknown')
-            logging.debug(f"🔍 Creating price snapshot for community: {community_name}")
+            logging.debug("🔍 Creating price snapshot for community: %s", community_name)
             community_id = community.get("community_id")
             current_price = float(community.get("price", 0))
             
             if not community_id or current_price <= 0:
-                logging.debug(f"⚠️ Skipping {community_name}: community_id={community_id}, price={current_price}")
+                logging.debug("⚠️ Skipping %s: community_id=%s, price=%s", community_name, community_id, current_price)
                 return None
             
-            logging.debug(f"✅ Valid community for price tracking: {community_name} @ ${current_price}")
+            logging.debug("✅ Valid community for price tracking: %s @ $%s", community_name, current_price)
             
-            # Get previous price from permanent storage
+            # Get previous price from the preloaded permanent records
             permanent_id = self.generate_permanent_id(community_id)
-            permanent_record = await self.price_history_permanent_collection.find_one(
-                {"permanent_property_id": permanent_id}
-            )
+            permanent_record = permanent_records.get(permanent_id)
             
             previous_price = 0
+            previous_date = None
             if permanent_record and permanent_record.get("price_timeline"):
                 last_timeline_entry = permanent_record["price_timeline"][-1]
                 previous_price = last_timeline_entry.get("price", 0)
+                previous_date = last_timeline_entry.get("date")
             
             # Always create daily snapshot regardless of price change
             change_amount = current_price - previous_price
@@ -168,15 +290,17 @@ class PriceTracker:
             return {
                 "listing_id": listing_id,
                 "community_id": community_id,
+                "permanent_property_id": permanent_id,
                 "property_name": community.get("name", ""),
                 "price": current_price,
                 "price_currency": community.get("price_currency", "USD"),
-                "snapshot_date": datetime.now(),
+                "snapshot_date": snapshot_date or datetime.now(),
                 "scraped_at": source_doc.get("scraped_at"),
                 "build_status": community.get("build_status", []),
                 "build_type": community.get("build_type", ""),
                 "change_metrics": {
                     "previous_price": previous_price,
+                    "previous_date": previous_date,
                     "change_amount": change_amount,
                     "change_percentage": round(change_percentage, 2),
                     "is_significant": abs(change_percentage) >= 5.0
@@ -185,28 +309,49 @@ class PriceTracker:
             }
             
         except Exception as e:
-            logging.debug(f"Error creating price snapshot: {e}")
+            logging.debug("Error creating price snapshot: %s", e)
             return None
     
-    async def _update_permanent_timelines(self, snapshots: List[Dict]):
-        """Update permanent storage with new price points"""
+    async def _update_permanent_timelines(self, snapshots: List[Dict], community_docs: Optional[Dict[str, Dict]] = None):
+        """
+        Update permanent storage with new price points.
+        community_docs maps listing_id to its communitydata document; missing listings are loaded in one $in query.
+        """
         try:
             logging.info(f"🔄 Starting permanent timeline updates for {len(snapshots)} snapshots")
-            updated_count = 0
+            community_docs = dict(community_docs or {})
+            missing_listing_ids = list({s["listing_id"] for s in snapshots} - community_docs.keys())
+            if missing_listing_ids:
+                async for doc in self.communitydata_collection.find(
+                    {"listing_id": {"$in": missing_listing_ids}},
+                    _COMMUNITY_SNAPSHOT_PROJECTION
+                ).batch_size(self.SNAPSHOT_BATCH_SIZE):
+                    community_docs[doc["listing_id"]] = doc
+            
+            now = datetime.now()  # shared last_updated/created_at for every record in this batch
+            timeline_ops = []
+            raw_ops = []
+            missing_address_count = 0
+            communities_by_listing = {}  # listing_id -> {community_id: community}, built once per listing
             for snapshot in snapshots:
                 listing_id = snapshot["listing_id"]
                 community_id = snapshot["community_id"]
-                permanent_id = self.generate_permanent_id(community_id)
+                permanent_id = snapshot.get("permanent_property_id") or self.generate_permanent_id(community_id)
                 
                 # Get community data from communitydata
-                community_doc = await self.communitydata_collection.find_one({"listing_id": listing_id})
+                community_doc = community_docs.get(listing_id)
                 if not community_doc:
                     logging.warning(f"⚠️ No community data found for listing_id: {listing_id}")
                     continue
                 
                 # Find the specific community within the document
-                communities = community_doc.get("community_data", {}).get("communities", [])
-                target_community = next((c for c in communities if c.get("community_id") == community_id), None)
+                communities_by_id = communities_by_listing.get(listing_id)
+                if communities_by_id is None:
+                    communities_by_id = communities_by_listing[listing_id] = {}
+                    for community in community_doc.get("community_data", {}).get("communities", []):
+                        # First match wins, as with the previous linear scan
+                        communities_by_id.setdefault(community.get("community_id"), community)
+                target_community = communities_by_id.get(community_id)
                 if not target_community:
                     logging.warning(f"⚠️ Community {community_id} not found in listing {listing_id}")
                     continue
@@ -227,35 +372,52 @@ class PriceTracker:
                 
                 # Build community snapshot
                 community_snapshot = self._build_community_snapshot(target_community, listing_id)
+                if not target_community.get("address"):
+                    missing_address_count += 1
                 
-                # Calculate aggregated metrics
-                aggregated_metrics = await self._calculate_aggregated_metrics(permanent_id, snapshot["price"])
-                
-                # Upsert permanent record
-                result = await self.price_history_permanent_collection.update_one(
-                    {"permanent_property_id": permanent_id},
-                    {
-                        "$set": {
-                            **community_snapshot,
-                            "aggregated_metrics": aggregated_metrics,
-                            "last_updated": datetime.now()
-                        },
-                        "$push": {"price_timeline": timeline_entry},
-                        "$setOnInsert": {"created_at": datetime.now()}
-                    },
+                # Queue upsert of permanent record; aggregated metrics are recomputed server-side in the same op
+                timeline_ops.append(UpdateOne(
+                    {"_id": permanent_id},
+                    self._build_timeline_update_pipeline(community_snapshot, timeline_entry, snapshot["price"], now),
                     upsert=True
-                )
-            
-                if result.upserted_id:
-                    logging.info(f"🆕 Created new price_history_permanent record for {community_id}")
-                elif result.modified_count > 0:
-                    logging.info(f"🔄 Updated price_history_permanent record for {community_id}")
-                else:
-                    logging.warning(f"⚠️ No changes made to price_history_permanent for {community_id}")
+                ))
                 
-                updated_count += 1
-            
-            logging.info(f"✅ Processed {updated_count}/{len(snapshots)} permanent timeline entries")
+                # Append to the uncapped raw history whenever the inline timeline appends; keyed on the
+                # full snapshot timestamp so a retried batch is a no-op but A→B→A within a day is kept
+                change_metrics = snapshot["change_metrics"]
+                if not _is_repeat_snapshot(change_metrics.get("previous_date"), change_metrics["previous_price"],
+                                           snapshot["price"], timeline_entry["date"]):
+                    raw_ops.append(UpdateOne(
+                        {"_id": f"{permanent_id}_{timeline_entry['date'].isoformat()}"},
+                        {"$setOnInsert": {
+                            "permanent_property_id": permanent_id,
+                            "community_id": community_id,
+                            "listing_id": listing_id,
+                            **timeline_entry
+                        }},
+                        upsert=True
+                    ))
+            
+            # One summary line per batch instead of a log call per community
+            logging.info(f"🏠 Built {len(timeline_ops)} community snapshots, {missing_address_count} missing address")
+            
+            # Flush queued upserts in unordered chunks so one bad record doesn't block the rest
+            created_count = 0
+            modified_count = 0
+            for i in range(0, len(timeline_ops), self.BULK_WRITE_BATCH_SIZE):
+                writes = [self.price_history_permanent_collection.bulk_write(
+                    timeline_ops[i:i + self.BULK_WRITE_BATCH_SIZE], ordered=False
+                )]
+                # Repeats have no raw op, so raw_ops may run out before timeline_ops does
+                raw_chunk = raw_ops[i:i + self.BULK_WRITE_BATCH_SIZE]
+                if raw_chunk:
+                    writes.append(self.price_timeline_raw_collection.bulk_write(raw_chunk, ordered=False))
+                result = (await asyncio.gather(*writes))[0]
+                created_count += result.upserted_count
+                modified_count += result.modified_count
+            
+            logging.info(f"🆕 Created {created_count} / 🔄 updated {modified_count} price_history_permanent records")
+            logging.info(f"✅ Processed {len(timeline_ops)}/{len(snapshots)} permanent timeline entries")
             
         except Exception as e:
             logging.error(f"❌ Error updating permanent timelines: {e}")
@@ -275,13 +437,6 @@ class PriceTracker:
         """Build community metadata for permanent storage"""
         address = community.get("address", {})
         
-        # Log address data availability for debugging
-        if address:
-            address_keys = list(address.keys())
-            logging.info(f"🏠 Building price history snapshot for '{community.get('name')}' with address keys: {address_keys}")
-        else:
-            logging.warning(f"⚠️ No address data found for community '{community.get('name')}' in price history snapshot")
-        
         return {
             "permanent_property_id": self.generate_permanent_id(community.get("community_id", "")),
             "community_id": community.get("community_id", ""),
@@ -298,61 +453,108 @@ class PriceTracker:
             }
         }
     
-    async def _calculate_aggregated_metrics(self, permanent_id: str, current_price: float) -> Dict:
-        """Calculate aggregated metrics for permanent storage"""
-        try:
-            # Get existing price timeline
-            existing_record = await self.price_history_permanent_collection.find_one(
-                {"permanent_property_id": permanent_id}
-            )
-            
-            price_timeline = existing_record.get("price_timeline", []) if existing_record else []
-            all_prices = [entry.get("price", 0) for entry in price_timeline] + [current_price]
-            all_prices = [p for p in all_prices if p > 0]  # Filter out invalid prices
-            
-            if not all_prices:
-                return {}
-            
-            # Calculate basic metrics
-            most_recent_price = all_prices[-1]
-            average_price = sum(all_prices) / len(all_prices)
-            min_price = min(all_prices)
-            max_price = max(all_prices)
-            total_days_tracked = len(all_prices)
-            
-            # Calculate moving averages (simplified for now)
-            moving_averages = {
-                "1_day_average": most_recent_price,
-                "7_day_average": average_price,
-                "30_day_average": average_price,
-                "90_day_average": average_price,
-                "180_day_average": average_price,
-                "365_day_average": average_price
-            }
-            
-            # Calculate percent changes (simplified for now)
-            percent_change_metrics = {
-                "1_day_change": 0,
-                "7_day_change": 0,
-                "30_day_change": 0,
-                "90_day_change": 0,
-                "180_day_change": 0,
-                "365_day_change": 0
-            }
-            
-            return {
-                "most_recent_price": most_recent_price,
-                "average_price": round(average_price, 2),
-                "min_price": min_price,
-                "max_price": max_price,
-                "total_days_tracked": total_days_tracked,
-                "moving_averages": moving_averages,
-                "percent_change_metrics": percent_change_metrics
+    def _build_timeline_update_pipeline(self, community_snapshot: Dict, timeline_entry: Dict, current_price: float,
+                                        now: Optional[datetime] = None) -> List[Dict]:
+        """
+        Build a pipeline-style update that appends a timeline entry and maintains
+        aggregated metrics from stored running totals, so price_timeline is never rescanned.
+        A rerun on the same day at an unchanged price is detected server-side and not appended again.
+        """
+        now = now or datetime.now()
+        valid_prices = {"$filter": {"input": "$price_timeline.price", "cond": {"$gt": ["$$this", 0]}}}
+        is_valid_price = current_price > 0
+        day_start = _day_start(timeline_entry["date"])
+        
+        # Repeat = the last entry was already recorded today at this price (string dates never match);
+        # _is_repeat_snapshot applies the same rule client-side for price_timeline_raw
+        is_repeat = {"$let": {
+            "vars": {"last": {"$arrayElemAt": [{"$ifNull": ["$price_timeline", []]}, -1]}},
+            "in": {"$and": [
+                {"$eq": ["$$last.price", current_price]},
+                {"$gte": ["$$last.date", day_start]}
+            ]}
+        }}
+        new_price = {"$cond": ["$_repeat_snapshot", None, current_price if is_valid_price else None]}
+        
+        # Running totals: add the new price to the stored totals, or derive them once from the
+        # timeline for records (new or written before running totals existed) that lack them
+        totals = {"$cond": [
+            {"$eq": [{"$type": "$aggregated_metrics.running_sum"}, "missing"]},
+            {"$let": {
+                "vars": {"prices": valid_prices},
+                "in": {
+                    "sum": {"$sum": "$$prices"},
+                    "count": {"$size": "$$prices"},
+                    "min": {"$min": "$$prices"},
+                    "max": {"$max": "$$prices"}
+                }
+            }},
+            {
+                "sum": {"$add": ["$aggregated_metrics.running_sum", {"$ifNull": [new_price, 0]}]},
+                "count": {"$add": ["$aggregated_metrics.total_days_tracked", {"$cond": [{"$eq": [new_price, None]}, 0, 1]}]},
+                "min": {"$min": ["$aggregated_metrics.min_price", new_price]},
+                "max": {"$max": ["$aggregated_metrics.max_price", new_price]}
             }
-            
-        except Exception as e:
-            logging.error(f"❌ Error calculating aggregated metrics: {e}")
-            return {}
+        ]}
+        
+        return [
+            {"$set": {"_repeat_snapshot": is_repeat}},
+            {"$set": {
+                # $literal keeps scraped strings starting with "$" from being read as field paths
+                **{field: {"$literal": value} for field, value in community_snapshot.items()},
+                "price_timeline": {"$cond": [
+                    "$_repeat_snapshot",
+                    "$price_timeline",
+                    {"$concatArrays": [
+                        {"$ifNull": ["$price_timeline", []]},
+                        {"$literal": [timeline_entry]}
+                    ]}
+                ]},
+                "last_updated": now,
+                "created_at": {"$ifNull": ["$created_at", now]}
+            }},
+            {"$set": {
+                "aggregated_metrics": {"$let": {
+                    "vars": {"totals": totals},
+                    "in": {"$let": {
+                        "vars": {"average_price": {"$cond": [
+                            {"$gt": ["$$totals.count", 0]},
+                            {"$divide": ["$$totals.sum", "$$totals.count"]},
+                            None
+                        ]}},
+                        "in": {
+                            "most_recent_price": current_price,
+                            "average_price": {"$round": ["$$average_price", 2]},
+                            "min_price": "$$totals.min",
+                            "max_price": "$$totals.max",
+                            "total_days_tracked": "$$totals.count",
+                            "running_sum": "$$totals.sum",
+                            # Calculate moving averages (simplified for now)
+                            "moving_averages": {
+                                "1_day_average": current_price,
+                                "7_day_average": "$$average_price",
+                                "30_day_average": "$$average_price",
+                                "90_day_average": "$$average_price",
+                                "180_day_average": "$$average_price",
+                                "365_day_average": "$$average_price"
+                            },
+                            # Calculate percent changes (simplified for now)
+                            "percent_change_metrics": {
+                                "1_day_change": 0,
+                                "7_day_change": 0,
+                                "30_day_change": 0,
+                                "90_day_change": 0,
+                                "180_day_change": 0,
+                                "365_day_change": 0
+                            }
+                        }
+                    }}
+                }}
+            }},
+            # Cap only after the totals are derived, so legacy records still see their full history once
+            {"$set": {"price_timeline": {"$slice": ["$price_timeline", -self.PRICE_TIMELINE_MAX_ENTRIES]}}},
+            {"$unset": "_repeat_snapshot"}
+        ]
     
     async def _create_city_price_snapshots(self):
         """Create aggregated city price snapshots from permanent storage"""
@@ -380,114 +582,139 @@ class PriceTracker:
                 }
             ]
             
-            city_aggregates = await self.price_history_permanent_collection.aggregate(pipeline).to_list(length=None)
-            
-            for city_data in city_aggregates:
-                city_info = city_data["_id"]
-                city_id = self.generate_permanent_id(f"{city_info['city']}_{city_info['county']}_{city_info['addressRegion']}")
-                
-                # Process properties by type and status
-                properties = city_data["properties"]
-                
-                # Active properties only
-                active_properties = [p for p in properties if p["listing_status"] == "active"]
-                active_sfr = [p for p in active_properties if p["accommodation_category"] == "Single Family Residence"]
-                active_condo = [p for p in active_properties if p["accommodation_category"] == "Condominium"]
-                
-                # Calculate current active metrics
-                sfr_count = len(active_sfr)
-                condo_count = len(active_condo)
-                sfr_avg_price = sum(p["current_price"] for p in active_sfr) / len(active_sfr) if active_sfr else None
-                condo_avg_price = sum(p["current_price"] for p in active_condo) / len(active_condo) if active_condo else None
-                overall_avg_price = sum(p["current_price"] for p in active_properties) / len(active_properties) if active_properties else None
-                
-                # Get existing historical data to preserve listing counts
-                existing_snapshot = await self.price_city_snapshot_collection.find_one({"city_id": city_id})
-                existing_historical = existing_snapshot.get("historical_daily_averages", []) if existing_snapshot else []
-                
-                # Calculate historical daily averages from all properties (active + archived)
-                calculated_historical = await self._calculate_historical_daily_averages(properties)
-                
-                # Preserve historical listing counts while updating prices
-                historical_daily_averages = await self._preserve_historical_listing_counts(
-                    existing_historical, calculated_historical, city_info
-                )
-                
-                # Add or update today's entry with current active metrics
-                today = datetime.now().date().isoformat()
-                today_entry = {
-                    "date": today,
-                    "sfr_avg_price": sfr_avg_price,
-                    "sfr_listing_count": sfr_count,  # Current active SFR count
-                    "condo_avg_price": condo_avg_price,
-                    "condo_listing_count": condo_count,  # Current active condo count
-                    "overall_avg_price": overall_avg_price,
-                    "overall_listing_count": len(active_properties)  # Current total active count
-                }
-                
-                # Update or append today's entry
-                today_exists = False
-                for i, entry in enumerate(historical_daily_averages):
-                    if entry.get("date") == today:
-                        historical_daily_averages[i] = today_entry
-                        today_exists = True
-                        break
-                
-                if not today_exists:
-                    historical_daily_averages.append(today_entry)
-                
-                # Sort by date and keep last 30 days
-                historical_daily_averages.sort(key=lambda x: x["date"])
-                historical_daily_averages = historical_daily_averages[-30:]
-                
-                # Calculate moving averages and percent changes from city historical data
-                sfr_metrics = await self._calculate_city_metrics(historical_daily_averages, "sfr")
-                condo_metrics = await self._calculate_city_metrics(historical_daily_averages, "condo")
-                overall_metrics = await self._calculate_city_metrics(historical_daily_averages, "overall")
+            # One timestamp for the whole run keeps every city's snapshot date consistent
+            now = datetime.now()
+            today = now.date().isoformat()
+            
+            # Stream cities from the aggregation in bounded batches instead of materializing them all
+            city_count = 0
+            city_batch = []
+            async for city_data in self.price_history_permanent_collection.aggregate(pipeline, allowDiskUse=True):
+                city_batch.append(city_data)
+                if len(city_batch) >= self.CITY_BATCH_SIZE:
+                    city_count += await self._process_city_batch(city_batch, now, today)
+                    city_batch = []
+            
+            if city_batch:
+                city_count += await self._process_city_batch(city_batch, now, today)
                 
-                # Build city snapshot document
-                city_snapshot = {
-                    "city_id": city_id,
-                    "addressLocality": city_info["city"],
-                    "county": city_info["county"],
-                    "addressRegion": city_info["addressRegion"],
-                    "current_active_metrics": {
-                        "sfr": {
-                            "count": sfr_count,
-                            "avg_price": sfr_avg_price,
-                            "moving_averages": sfr_metrics["moving_averages"],
-                            "percent_changes": sfr_metrics["percent_changes"]
-                        },
-                        "condo": {
-                            "count": condo_count,
-                            "avg_price": condo_avg_price,
-                            "moving_averages": condo_metrics["moving_averages"],
-                            "percent_changes": condo_metrics["percent_changes"]
-                        },
-                        "overall": {
-                            "total_properties": len(active_properties),
-                            "avg_price": overall_avg_price,
-                            "moving_averages": overall_metrics["moving_averages"],
-                            "percent_changes": overall_metrics["percent_changes"]
-                        }
-                    },
-                    "historical_daily_averages": historical_daily_averages,
-                    "last_snapshot_date": datetime.now(),
-                    "created_at": datetime.now()
-                }
-                
-                # Upsert city snapshot
-                await self.price_city_snapshot_collection.update_one(
-                    {"city_id": city_id},
-                    {"$set": city_snapshot},
-                    upsert=True
-                )
-                
-            logging.info(f"✅ Created {len(city_aggregates)} city price snapshots")
+            logging.info(f"✅ Created {city_count} city price snapshots")
             
         except Exception as e:
             logging.error(f"❌ Error creating city price snapshots: {e}")
     
+    async def _process_city_batch(self, city_batch: List[Dict], now: datetime, today: str) -> int:
+        """
+        Build and upsert city snapshots for a batch of aggregated cities.
+        
+        Input: city_batch (List[Dict]) - city aggregation results, now/today - run timestamp and its ISO date
+        Output: int - number of city snapshots written
+        """
+        city_ops = []
+        
+        city_ids = [
+            self.generate_permanent_id(f"{c['_id']['city']}_{c['_id']['county']}_{c['_id']['addressRegion']}")
+            for c in city_batch
+        ]
+        
+        # Prefetch existing historical data for the batch in one query to preserve listing counts
+        existing_snapshots = await self.price_city_snapshot_collection.find(
+            {"_id": {"$in": city_ids}},
+            {"historical_daily_averages": 1}
+        ).to_list(length=None)
+        existing_by_city_id = {e["_id"]: e for e in existing_snapshots}
+        
+        for city_data, city_id in zip(city_batch, city_ids):
+            city_info = city_data["_id"]
+            
+            # Process properties by type and status
+            properties = city_data["properties"]
+            
+            # Active properties only
+            active_properties = [p for p in properties if p["listing_status"] == "active"]
+            active_sfr = [p for p in active_properties if p["accommodation_category"] == "Single Family Residence"]
+            active_condo = [p for p in active_properties if p["accommodation_category"] == "Condominium"]
+            
+            # Calculate current active metrics
+            sfr_count = len(active_sfr)
+            condo_count = len(active_condo)
+            sfr_avg_price = fmean(p["current_price"] for p in active_sfr) if active_sfr else None
+            condo_avg_price = fmean(p["current_price"] for p in active_condo) if active_condo else None
+            overall_avg_price = fmean(p["current_price"] for p in active_properties) if active_properties else None
+            
+            existing_snapshot = existing_by_city_id.get(city_id)
+            existing_historical = existing_snapshot.get("historical_daily_averages", []) if existing_snapshot else []
+            
+            # Calculate historical daily averages from all properties (active + archived)
+            calculated_historical = await self._calculate_historical_daily_averages(properties)
+            
+            # Preserve historical listing counts while updating prices
+            historical_daily_averages = await self._preserve_historical_listing_counts(
+                existing_historical, calculated_historical, city_info
+            )
+            
+            # Add or update today's entry with current active metrics
+            today_entry = {
+                "date": today,
+                "sfr_avg_price": sfr_avg_price,
+                "sfr_listing_count": sfr_count,  # Current active SFR count
+                "condo_avg_price": condo_avg_price,
+                "condo_listing_count": condo_count,  # Current active condo count
+                "overall_avg_price": overall_avg_price,
+                "overall_listing_count": len(active_properties)  # Current total active count
+            }
+            
+            # Update or append today's entry, keyed by date
+            by_date = {entry["date"]: entry for entry in historical_daily_averages}
+            by_date[today] = today_entry
+            
+            # Sort by date and keep last 30 days
+            historical_daily_averages = sorted(by_date.values(), key=lambda x: x["date"])[-30:]
+            
+            # Calculate moving averages and percent changes from city historical data
+            sfr_metrics = await self._calculate_city_metrics(historical_daily_averages, "sfr")
+            condo_metrics = await self._calculate_city_metrics(historical_daily_averages, "condo")
+            overall_metrics = await self._calculate_city_metrics(historical_daily_averages, "overall")
+            
+            # Build city snapshot document
+            city_snapshot = {
+                "city_id": city_id,
+                "addressLocality": city_info["city"],
+                "county": city_info["county"],
+                "addressRegion": city_info["addressRegion"],
+                "current_active_metrics": {
+                    "sfr": {
+                        "count": sfr_count,
+                        "avg_price": sfr_avg_price,
+                        "moving_averages": sfr_metrics["moving_averages"],
+                        "percent_changes": sfr_metrics["percent_changes"]
+                    },
+                    "condo": {
+                        "count": condo_count,
+                        "avg_price": condo_avg_price,
+                        "moving_averages": condo_metrics["moving_averages"],
+                        "percent_changes": condo_metrics["percent_changes"]
+                    },
+                    "overall": {
+                        "total_properties": len(active_properties),
+                        "avg_price": overall_avg_price,
+                        "moving_averages": overall_metrics["moving_averages"],
+                        "percent_changes": overall_metrics["percent_changes"]
+                    }
+                },
+                "historical_daily_averages": historical_daily_averages,
+                "last_snapshot_date": now,
+                "created_at": now
+            }
+            
+            # The whole city document is rebuilt, so replace it rather than $set each field
+            city_ops.append(ReplaceOne({"_id": city_id}, city_snapshot, upsert=True))
+        
+        # Upsert city snapshots in one unordered bulk write
+        if city_ops:
+            await self.price_city_snapshot_collection.bulk_write(city_ops, ordered=False)
+        return len(city_ops)
+    
     async def _preserve_historical_listing_counts(self, existing_historical: List[Dict], 
                                                 calculated_historical: List[Dict], 
                                                 city_info: Dict) -> List[Dict]:
@@ -525,11 +752,11 @@ class PriceTracker:
                         preserved_entry["overall_listing_count"] = preserved_counts["overall_listing_count"]
                     
                     preserved_historical.append(preserved_entry)
-                    logging.debug(f"📊 Preserved counts for {date}: SFR={preserved_counts['sfr_listing_count']}, Overall={preserved_counts['overall_listing_count']}")
+                    logging.debug("📊 Preserved counts for %s: SFR=%s, Overall=%s", date, preserved_counts['sfr_listing_count'], preserved_counts['overall_listing_count'])
                 else:
                     # New historical date - use calculated values
                     preserved_historical.append(calc_entry)
-                    logging.debug(f"📊 New historical date {date}: SFR={calc_entry.get('sfr_listing_count')}, Overall={calc_entry.get('overall_listing_count')}")
+                    logging.debug("📊 New historical date %s: SFR=%s, Overall=%s", date, calc_entry.get('sfr_listing_count'), calc_entry.get('overall_listing_count'))
             
             logging.info(f"🔄 Preserved historical counts for {len(existing_counts_by_date)} existing dates in {city_info.get('city', 'Unknown City')}")
             return preserved_historical
@@ -615,14 +842,12 @@ class PriceTracker:
             
             for days in moving_avg_timeframes:
                 if len(price_data) >= days:
-                    recent_prices = [entry["price"] for entry in price_data[-days:]]
-                    avg = sum(recent_prices) / len(recent_prices)
+                    avg = fmean(entry["price"] for entry in price_data[-days:])
                     moving_averages[f"{days}_day_average"] = round(avg, 2)
                 else:
                     # Use all available data if we don't have enough days
-                    all_prices = [entry["price"] for entry in price_data]
-                    if all_prices:
-                        avg = sum(all_prices) / len(all_prices)
+                    if price_data:
+                        avg = fmean(entry["price"] for entry in price_data)
                         moving_averages[f"{days}_day_average"] = round(avg, 2)
                     else:
                         moving_averages[f"{days}_day_average"] = None
@@ -642,12 +867,12 @@ class PriceTracker:
                     if past_price > 0:
                         change = ((current_price - past_price) / past_price * 100)
                         percent_changes[key] = round(change, 2)
-                        logging.debug(f"📊 {property_type} {days}-day: ${past_price:.2f} -> ${current_price:.2f} = {change:.2f}%")
+                        logging.debug("📊 %s %s-day: $%.2f -> $%.2f = %.2f%%", property_type, days, past_price, current_price, change)
                     else:
                         percent_changes[key] = None
                 else:
                     percent_changes[key] = None
-                    logging.debug(f"📊 {property_type} {days}-day: Insufficient data ({len(price_data)} points, need {required_points})")
+                    logging.debug("📊 %s %s-day: Insufficient data (%s points, need %s)", property_type, days, len(price_data), required_points)
             
             logging.info(f"✅ Calculated {property_type} metrics from {len(price_data)} historical data points")
             
@@ -672,98 +897,120 @@ class PriceTracker:
                 "percent_changes": {f"{days}_day_change": None for days in percent_change_timeframes}
             }
     
+    def _parse_timeline(self, timeline: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Parse a price timeline once into time-sorted datetime64[D] dates and matching float64 prices.
+        Entries are ordered by their full timestamp before truncating to the day, so the latest
+        entry of a day wins regardless of storage order (identical timestamps keep storage order).
+        """
+        timestamps = []
+        prices = []
+        for entry in timeline:
+            entry_date = entry.get("date")
+            if not entry_date:
+                continue
+            if isinstance(entry_date, datetime):
+                entry_timestamp = entry_date
+            elif isinstance(entry_date, str):
+                try:
+                    entry_timestamp = datetime.fromisoformat(entry_date)
+                except ValueError:
+                    try:
+                        entry_timestamp = datetime.fromisoformat(entry_date[:10])
+                    except ValueError:
+                        continue
+            else:
+                continue
+            # Wall-clock time, so the day matches the entry's own date
+            timestamps.append(entry_timestamp.replace(tzinfo=None))
+            prices.append(entry.get("price") or 0)
+        
+        timestamps_arr = np.array(timestamps, dtype='datetime64[us]')
+        order = np.argsort(timestamps_arr, kind='stable')
+        return timestamps_arr[order].astype('datetime64[D]'), np.array(prices, dtype=np.float64)[order]
+    
     async def _calculate_historical_daily_averages(self, properties: List[Dict]) -> List[Dict]:
+        """Calculate daily averages in a worker thread so the CPU-bound work doesn't block pending Mongo I/O"""
+        return await asyncio.to_thread(self._calculate_historical_daily_averages_sync, properties)
+    
+    def _calculate_historical_daily_averages_sync(self, properties: List[Dict]) -> List[Dict]:
         """Calculate daily average prices and active listing counts from all properties' timelines"""
         try:
-            daily_data = {}
-            
-            # First, determine all unique dates across all timelines
+            # Parse each timeline once into sorted (dates, prices) arrays and collect all unique dates
+            parsed_timelines = []
             all_dates = set()
             for prop in properties:
-                timeline = prop.get("price_timeline", [])
-                for entry in timeline:
-                    date = entry.get("date")
-                    if date:
-                        if hasattr(date, 'date'):
-                            date_str = date.date().isoformat()
-                        elif isinstance(date, str):
-                            date_str = date[:10]
-                        else:
-                            continue
-                        all_dates.add(date_str)
+                dates_arr, prices_arr = self._parse_timeline(prop.get("price_timeline", []))
+                parsed_timelines.append((prop.get("accommodation_category", ""), dates_arr, prices_arr))
+                all_dates.update(dates_arr.astype(str).tolist())
             
-            # For each date, find all properties that were active (had a price entry on or before that date)
-            for date_str in all_dates:
-                target_date = datetime.fromisoformat(date_str).date()
+            # Only the last 30 days are returned, and each day depends only on entries on or
+            # before it, so earlier dates never need to be evaluated
+            date_keys = sorted(all_dates)[-30:]
+            target_dates = np.array(date_keys, dtype='datetime64[D]')
+            
+            # Per category: the day index and price of every (property, date) pair where the property was active
+            day_indices = {"sfr": [], "condo": [], "all": []}
+            day_prices = {"sfr": [], "condo": [], "all": []}
+            
+            for prop_type, dates_arr, prices_arr in parsed_timelines:
+                if not len(dates_arr):
+                    continue
                 
-                daily_data[date_str] = {
-                    "sfr": {"prices": [], "properties": set()}, 
-                    "condo": {"prices": [], "properties": set()}, 
-                    "all": {"prices": [], "properties": set()}
-                }
+                # Index of the most recent price entry on or before each target date (-1 if none)
+                idx = np.searchsorted(dates_arr, target_dates, side='right') - 1
+                latest_prices = np.where(idx >= 0, prices_arr[idx], 0.0)
                 
-                for prop in properties:
-                    timeline = prop.get("price_timeline", [])
-                    prop_type = prop.get("accommodation_category", "")
-                    prop_id = prop.get("permanent_property_id") or prop.get("community_id", "")
-                    
-                    # Find the most recent price entry for this property on or before target_date
-                    valid_entries = []
-                    for entry in timeline:
-                        entry_date = entry.get("date")
-                        if entry_date:
-                            if hasattr(entry_date, 'date'):
-                                entry_date_obj = entry_date.date()
-                            elif isinstance(entry_date, str):
-                                try:
-                                    entry_date_obj = datetime.fromisoformat(entry_date[:10]).date()
-                                except:
-                                    continue
-                            else:
-                                continue
-                            
-                            # Only include entries on or before target date
-                            if entry_date_obj <= target_date:
-                                valid_entries.append((entry_date_obj, entry.get("price")))
-                    
-                    # If property has any valid entries, it was active on this date
-                    if valid_entries:
-                        # Get the most recent price (latest date)
-                        valid_entries.sort(key=lambda x: x[0], reverse=True)
-                        latest_price = valid_entries[0][1]
-                        
-                        if latest_price:
-                            # Add to daily data
-                            daily_data[date_str]["all"]["prices"].append(latest_price)
-                            daily_data[date_str]["all"]["properties"].add(prop_id)
-                            
-                            if prop_type == "Single Family Residence":
-                                daily_data[date_str]["sfr"]["prices"].append(latest_price)
-                                daily_data[date_str]["sfr"]["properties"].add(prop_id)
-                            elif prop_type == "Condominium":
-                                daily_data[date_str]["condo"]["prices"].append(latest_price)
-                                daily_data[date_str]["condo"]["properties"].add(prop_id)
+                # A property is active on a date once it has a non-zero price on or before it
+                active_days = np.flatnonzero(latest_prices)
+                active_prices = latest_prices[active_days]
+                
+                categories = ["all"]
+                if prop_type == "Single Family Residence":
+                    categories.append("sfr")
+                elif prop_type == "Condominium":
+                    categories.append("condo")
+                
+                for category in categories:
+                    day_indices[category].append(active_days)
+                    day_prices[category].append(active_prices)
+            
+            # Group-by-day sums and counts; each property contributes one price per date, so counts are listing counts
+            num_days = len(date_keys)
+            sums = {}
+            counts = {}
+            for category in day_indices:
+                if day_indices[category]:
+                    indices = np.concatenate(day_indices[category])
+                    sums[category] = np.bincount(indices, weights=np.concatenate(day_prices[category]), minlength=num_days)
+                    counts[category] = np.bincount(indices, minlength=num_days)
+                else:
+                    sums[category] = np.zeros(num_days)
+                    counts[category] = np.zeros(num_days, dtype=np.int64)
+            
+            averages = {
+                category: sums[category] / np.maximum(counts[category], 1)
+                for category in sums
+            }
             
             # Calculate daily averages with accurate listing counts
             daily_averages = []
-            for date_str in sorted(daily_data.keys()):
-                day_data = daily_data[date_str]
-                
-                sfr_prices = day_data["sfr"]["prices"]
-                condo_prices = day_data["condo"]["prices"]
-                all_prices = day_data["all"]["prices"]
+            for i, date_str in enumerate(date_keys):
+                sfr_count = int(counts["sfr"][i])
+                condo_count = int(counts["condo"][i])
+                all_count = int(counts["all"][i])
                 
                 daily_averages.append({
                     "date": date_str,
-                    "sfr_avg_price": round(sum(sfr_prices) / len(sfr_prices), 2) if sfr_prices else None,
-                    "sfr_listing_count": len(day_data["sfr"]["properties"]),
-                    "condo_avg_price": round(sum(condo_prices) / len(condo_prices), 2) if condo_prices else None,
-                    "condo_listing_count": len(day_data["condo"]["properties"]),
-                    "overall_avg_price": round(sum(all_prices) / len(all_prices), 2) if all_prices else None,
-                    "overall_listing_count": len(day_data["all"]["properties"])
+                    "sfr_avg_price": round(float(averages["sfr"][i]), 2) if sfr_count else None,
+                    "sfr_listing_count": sfr_count,
+                    "condo_avg_price": round(float(averages["condo"][i]), 2) if condo_count else None,
+                    "condo_listing_count": condo_count,
+                    "overall_avg_price": round(float(averages["all"][i]), 2) if all_count else None,
+                    "overall_listing_count": all_count
                 })
             
-            return daily_averages[-30:]  # Return last 30 days
+            return daily_averages
             
         except Exception as e:
             logging.error(f"❌ Error calculating historical daily averages: {e}")
@@ -851,54 +1098,6 @@ class PriceTracker:
                 "percent_changes": {"1_day_change": None, "7_day_change": None, "30_day_change": None, "90_day_change": None}
             }
     
-    def _extract_county_from_address(self, address: Dict) -> str:
-        """Extract county from address data"""
-        # This would need to be customized based on your location mapping
-        city = address.get("addressLocality", "").lower()
-        if "ventura" in city:
-            return "Ventura County"
-        elif "riverside" in city or "temecula" in city:
-            return "Riverside County"
-        return "Unknown County"
-    
-    async def consolidate_to_permanent_storage(self, listing_id: str):
-        """
-        Consolidate price history to permanent storage when property is archived
-        Called from Stage 1 archiving process
-        """
-        try:
-            logging.info(f"🔄 Consolidating price history for {listing_id}")
-            
-            # Get permanent price history for this property
-            permanent_records = await self.price_history_permanent_collection.find(
-                {"original_listing_id": listing_id}
-            ).to_list(length=None)
-            
-            if not permanent_records:
-                logging.warning(f"⚠️ No permanent price history found for {listing_id}")
-                return
-            
-            # Note: Legacy archival lookup removed - price history preserved permanently
-            
-            # Update permanent storage to mark as archived
-            for record in permanent_records:
-                await self.price_history_permanent_collection.update_one(
-                    {"permanent_property_id": record["permanent_property_id"]},
-                    {"$set": {
-                        "property_snapshot.status": "archived",
-                        "archive_metadata": {
-                            "archived_at": datetime.now(),
-                            "archive_reason": "property archived"
-                        },
-                        "last_updated": datetime.now()
-                    }}
-                )
-            
-            logging.info(f"✅ Marked {len(permanent_records)} permanent records as archived for {listing_id}")
-            
-        except Exception as e:
-            logging.error(f"❌ Error consolidating price history for {listing_id}: {e}")
-    
     def _calculate_volatility(self, prices: List[float]) -> float:
         """Calculate simple price volatility score"""
         if len(prices) < 2:
@@ -934,40 +1133,52 @@ class PriceTracker:
 
     async def update_archived_community_status(self, listing_id: str):
         """Update listing_status to archived in price_history_permanent when community is archived"""
+        await self.update_archived_community_statuses([listing_id])
+    
+    async def update_archived_community_statuses(self, listing_ids: List[str]):
+        """
+        Update listing_status to archived in price_history_permanent for a batch of archived listings.
+        
+        Input: listing_ids (List[str]) - listings already moved to communitydata_archived
+        """
         try:
-            # Get the archived community data to find individual community_ids
-            archived_doc = await self.db['communitydata_archived'].find_one({"listing_id": listing_id})
-            
-            if not archived_doc:
-                logging.warning(f"⚠️ No archived community data found for {listing_id}")
-                return
-            
-            communities = archived_doc.get("community_data", {}).get("communities", [])
+            now = datetime.now()
+            ops = []
+            found_listing_ids = set()
+            
+            # Get the archived community data for every listing in one $in query (only the ids are shipped back)
+            async for archived_doc in self.db['communitydata_archived'].find(
+                {"listing_id": {"$in": list(listing_ids)}},
+                {"listing_id": 1, "community_data.communities.community_id": 1}
+            ).batch_size(self.BULK_WRITE_BATCH_SIZE):
+                found_listing_ids.add(archived_doc["listing_id"])
+                for community in archived_doc.get("community_data", {}).get("communities", []):
+                    if community.get("community_id"):
+                        ops.append(UpdateOne(
+                            {"_id": self.generate_permanent_id(community["community_id"])},
+                            {"$set": {
+                                "listing_status": "archived",
+                                "archived_at": now,
+                                "last_updated": now
+                            }}
+                        ))
+            
+            for listing_id in listing_ids:
+                if listing_id not in found_listing_ids:
+                    logging.warning(f"⚠️ No archived community data found for {listing_id}")
+            
+            # Update listing_status to archived in price_history_permanent in unordered chunks
             updated_count = 0
+            for i in range(0, len(ops), self.BULK_WRITE_BATCH_SIZE):
+                result = await self.price_history_permanent_collection.bulk_write(
+                    ops[i:i + self.BULK_WRITE_BATCH_SIZE], ordered=False
+                )
+                updated_count += result.modified_count
             
-            for community in communities:
-                community_id = community.get("community_id")
-                if community_id:
-                    permanent_id = self.generate_permanent_id(community_id)
-                    
-                    # Update listing_status to archived in price_history_permanent
-                    result = await self.price_history_permanent_collection.update_one(
-                        {"permanent_property_id": permanent_id},
-                        {"$set": {
-                            "listing_status": "archived",
-                            "archived_at": datetime.now(),
-                            "last_updated": datetime.now()
-                        }}
-                    )
-                    
-                    if result.modified_count > 0:
-                        updated_count += 1
-                        logging.info(f"✅ Updated price history status to archived for {community_id}")
-            
-            logging.info(f"✅ Updated {updated_count} price history records to archived status for {listing_id}")
+            logging.info(f"✅ Updated {updated_count} price history records to archived status for {len(found_listing_ids)} listings")
             
         except Exception as e:
-            logging.error(f"❌ Error updating archived community status for {listing_id}: {e}")
+            logging.error(f"❌ Error updating archived community status for {len(listing_ids)} listings: {e}")
     
     async def cleanup_old_price_history(self, days_to_keep: int = 365):
         """Clean up old price history records (keep permanent storage)"""
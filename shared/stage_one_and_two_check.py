@@ -5,18 +5,46 @@ Handles masterplan detection and routing between Stage 1 and Stage 2
 
 import asyncio
 import logging
+import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, WriteConcern
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# listing_id substrings (case-insensitive) that route a listing away from Stage 2
+_MASTERPLAN_RE = re.compile("masterplan", re.IGNORECASE)
+_BASICCOMMUNITY_RE = re.compile("basiccommunity", re.IGNORECASE)
+SPECIAL_COMMUNITY_KINDS = ["masterplan", "basiccommunity"]
+
+# Shared read-only fallback for missing sub-documents (never mutated)
+_EMPTY: Dict = {}
+
+
+def classify_community_kind(listing_id: str) -> str:
+    """
+    Classify a listing by its listing_id; stored on homepagedata as community_kind at Stage 1 write time.
+    
+    Input: listing_id (str)
+    Output: str - "masterplan", "basiccommunity" or "regular"
+    """
+    if _MASTERPLAN_RE.search(listing_id):
+        return "masterplan"
+    if _BASICCOMMUNITY_RE.search(listing_id):
+        return "basiccommunity"
+    return "regular"
+
 
 class StageOneAndTwoCheck:
     """Checks Stage 1 results and routes masterplan vs regular communities"""
     
+    SPECIAL_WRITE_BATCH_SIZE = 500
+    SPECIAL_WRITE_CONCURRENCY = 4
+    CURSOR_BATCH_SIZE = 2000
+    
     def __init__(self):
         self.client = None
         self.db = None
@@ -35,13 +63,27 @@ class StageOneAndTwoCheck:
             
             self.homepagedata_collection = self.db['homepagedata']
             self.homepagedata_archived_collection = self.db_archived['homepagedata_archived']
-            self.masterplandata_collection = self.db['masterplandata']
-            self.basiccommunitydata_collection = self.db['basiccommunitydata']
+            # Special collections are rewritten from homepagedata on every routing pass, so their
+            # idempotent upserts only need a primary acknowledgement
+            self.masterplandata_collection = self.db.get_collection('masterplandata', write_concern=WriteConcern(w=1))
+            self.basiccommunitydata_collection = self.db.get_collection('basiccommunitydata', write_concern=WriteConcern(w=1))
             
             # Create indexes for special collections
             await self.masterplandata_collection.create_index([("masterplanlisting_id", 1)])
             await self.basiccommunitydata_collection.create_index([("basic_community_listing_id", 1)])
             
+            # Routing and missing-listing scans on homepagedata; trailing listing_id keeps the id-only projections covered
+            await self.homepagedata_collection.create_index([("community_kind", 1), ("listing_status", 1), ("listing_id", 1)])
+            await self.homepagedata_collection.create_index([("scraped_at", 1), ("listing_status", 1), ("listing_id", 1)])
+            
+            # listing_id is Stage 1's natural key: per-listing find_one/replace_one/update_one and the archive $in match/delete_many
+            try:
+                await self.homepagedata_collection.create_index([("listing_id", 1)], unique=True)
+            except Exception as e:
+                # Legacy duplicate listing_ids block the unique build; keep the lookups indexed regardless
+                logging.warning(f"⚠️ Unique listing_id index not created ({e}) - falling back to a non-unique index")
+                await self.homepagedata_collection.create_index([("listing_id", 1)])
+            
             logging.info("✅ StageOneAndTwoCheck connected to MongoDB")
             return True
         except Exception as e:
@@ -58,41 +100,82 @@ class StageOneAndTwoCheck:
         try:
             logging.info("🔍 Analyzing Stage 1 results for special community types...")
             
-            # Get all active listings from homepagedata
+            # Only special communities need their full property_data shipped back
             cursor = self.homepagedata_collection.find(
-                {"listing_status": {"$in": ["new", "updated", "active"]}},
-                {"listing_id": 1, "property_data": 1, "scraped_at": 1, "source_url": 1, "data_source": 1, "listing_status": 1}
-            )
+                {
+                    "listing_status": {"$in": ["new", "updated", "active"]},
+                    "community_kind": {"$in": SPECIAL_COMMUNITY_KINDS}
+                },
+                {"listing_id": 1, "community_kind": 1, "property_data": 1, "scraped_at": 1, "source_url": 1, "data_source": 1, "listing_status": 1}
+            ).batch_size(self.CURSOR_BATCH_SIZE)
             
             regular_listings = []
             masterplan_listings = []
             basiccommunity_listings = []
-            masterplan_processed = 0
-            basiccommunity_processed = 0
+            masterplan_ops = []
+            basiccommunity_ops = []
+            masterplan_counts = {"new": 0, "updated": 0}
+            basiccommunity_counts = {"new": 0, "updated": 0}
+            flush_slots = asyncio.Semaphore(self.SPECIAL_WRITE_CONCURRENCY)
+            flush_tasks = []
+            now = datetime.now()  # one last_updated for the whole pass
+            
+            async def run_flush(collection, ops: List[UpdateOne], counts: Dict[str, int]):
+                try:
+                    await self._flush_special_upserts(collection, ops, counts)
+                finally:
+                    flush_slots.release()
+            
+            async def schedule_flush(collection, ops: List[UpdateOne], counts: Dict[str, int]):
+                # Wait for a free slot, then let this bulk write overlap the next cursor fetch
+                await flush_slots.acquire()
+                flush_tasks.append(asyncio.create_task(run_flush(collection, ops, counts)))
             
             async for doc in cursor:
                 listing_id = doc.get("listing_id", "")
                 
-                if self._is_masterplan_community(listing_id):
-                    # Process masterplan community
-                    await self._process_masterplan_community(doc)
+                if doc["community_kind"] == "masterplan":
+                    # Queue masterplan community upsert
+                    masterplan_ops.append(self._build_masterplan_upsert(doc, now))
                     masterplan_listings.append(listing_id)
-                    masterplan_processed += 1
-                elif self._is_basiccommunity_community(listing_id):
-                    # Process basic community
-                    await self._process_basiccommunity_community(doc)
-                    basiccommunity_listings.append(listing_id)
-                    basiccommunity_processed += 1
+                    if len(masterplan_ops) >= self.SPECIAL_WRITE_BATCH_SIZE:
+                        await schedule_flush(self.masterplandata_collection, masterplan_ops, masterplan_counts)
+                        masterplan_ops = []
                 else:
-                    # Regular community - continue to Stage 2
-                    regular_listings.append(listing_id)
+                    # Queue basic community upsert
+                    basiccommunity_ops.append(self._build_basiccommunity_upsert(doc, now))
+                    basiccommunity_listings.append(listing_id)
+                    if len(basiccommunity_ops) >= self.SPECIAL_WRITE_BATCH_SIZE:
+                        await schedule_flush(self.basiccommunitydata_collection, basiccommunity_ops, basiccommunity_counts)
+                        basiccommunity_ops = []
+            
+            if masterplan_ops:
+                await schedule_flush(self.masterplandata_collection, masterplan_ops, masterplan_counts)
+            if basiccommunity_ops:
+                await schedule_flush(self.basiccommunitydata_collection, basiccommunity_ops, basiccommunity_counts)
+            
+            # Regular communities - continue to Stage 2; only their ids are needed (scanned while the last special writes finish)
+            async for doc in self.homepagedata_collection.find(
+                {
+                    "community_kind": "regular",
+                    "listing_status": {"$in": ["new", "updated", "active"]}
+                },
+                {"listing_id": 1, "_id": 0}
+            ).batch_size(self.CURSOR_BATCH_SIZE):
+                regular_listings.append(doc.get("listing_id", ""))
+            
+            await asyncio.gather(*flush_tasks)
+            masterplan_processed = masterplan_counts["new"] + masterplan_counts["updated"]
+            basiccommunity_processed = basiccommunity_counts["new"] + basiccommunity_counts["updated"]
             
             logging.info(f"📊 Stage 1 Analysis Complete:")
             logging.info(f"   🏘️ Regular communities (to Stage 2): {len(regular_listings)}")
             logging.info(f"   🏗️ Masterplan communities (to masterplandata): {len(masterplan_listings)}")
             logging.info(f"   🏠 Basic communities (to basiccommunitydata): {len(basiccommunity_listings)}")
-            logging.info(f"   ✅ Masterplan documents processed: {masterplan_processed}")
-            logging.info(f"   ✅ Basic community documents processed: {basiccommunity_processed}")
+            logging.info(f"   ✅ Masterplan documents processed: {masterplan_processed} "
+                         f"(🆕 {masterplan_counts['new']} new / 🔄 {masterplan_counts['updated']} updated)")
+            logging.info(f"   ✅ Basic community documents processed: {basiccommunity_processed} "
+                         f"(🆕 {basiccommunity_counts['new']} new / 🔄 {basiccommunity_counts['updated']} updated)")
             
             return regular_listings, masterplan_listings, basiccommunity_listings
             
@@ -100,107 +183,87 @@ class StageOneAndTwoCheck:
             logging.error(f"❌ Error processing Stage 1 results: {e}")
             return [], [], []
     
-    def _is_masterplan_community(self, listing_id: str) -> bool:
+    def _build_masterplan_upsert(self, homepage_doc: Dict, now: datetime) -> UpdateOne:
         """
-        Check if listing_id contains 'masterplan'.
+        Build the masterplandata upsert for a masterplan community.
         
-        Input: listing_id (str)
-        Output: bool - True if masterplan community
+        Input: homepage_doc (Dict) - document from homepagedata, now (datetime) - last_updated timestamp
+        Output: UpdateOne - upsert keyed by masterplanlisting_id
         """
-        return "masterplan" in listing_id.lower()
+        listing_id = homepage_doc.get("listing_id")
+        
+        # Transform document structure for masterplandata
+        masterplan_doc = {
+            "masterplanlisting_id": listing_id,  # Change from listing_id
+            "scraped_at": homepage_doc.get("scraped_at"),
+            "source_url": homepage_doc.get("source_url"),
+            "masterplan_data": self._transform_property_data(homepage_doc.get("property_data", {})),  # Change from property_data
+            "data_source": homepage_doc.get("data_source"),
+            "listing_status": homepage_doc.get("listing_status"),
+            "last_updated": now
+        }
+        
+        return UpdateOne(
+            {"masterplanlisting_id": listing_id},
+            self._build_replace_pipeline(masterplan_doc),
+            upsert=True
+        )
     
-    def _is_basiccommunity_community(self, listing_id: str) -> bool:
+    def _build_basiccommunity_upsert(self, homepage_doc: Dict, now: datetime) -> UpdateOne:
         """
-        Check if listing_id contains 'basiccommunity'.
+        Build the basiccommunitydata upsert for a basic community.
         
-        Input: listing_id (str)
-        Output: bool - True if basic community
+        Input: homepage_doc (Dict) - document from homepagedata, now (datetime) - last_updated timestamp
+        Output: UpdateOne - upsert keyed by basic_community_listing_id
         """
-        return "basiccommunity" in listing_id.lower()
+        listing_id = homepage_doc.get("listing_id")
+        
+        # Transform document structure for basiccommunitydata
+        basiccommunity_doc = {
+            "basic_community_listing_id": listing_id,  # Change from listing_id
+            "scraped_at": homepage_doc.get("scraped_at"),
+            "source_url": homepage_doc.get("source_url"),
+            "basic_community_data": homepage_doc.get("property_data", {}),  # Change from property_data
+            "data_source": homepage_doc.get("data_source"),
+            "listing_status": homepage_doc.get("listing_status"),
+            "last_updated": now
+        }
+        
+        return UpdateOne(
+            {"basic_community_listing_id": listing_id},
+            self._build_replace_pipeline(basiccommunity_doc),
+            upsert=True
+        )
     
-    async def _process_masterplan_community(self, homepage_doc: Dict):
+    def _build_replace_pipeline(self, new_doc: Dict) -> List[Dict]:
         """
-        Process masterplan community and save to masterplandata collection.
+        Build a pipeline update that replaces the stored document with new_doc,
+        carrying the stored scraped_at over as previous_scraped_at (no pre-read needed).
+        On insert there is no stored scraped_at, so previous_scraped_at is left out.
         
-        Input: homepage_doc (Dict) - document from homepagedata
+        Input: new_doc (Dict) - replacement document
+        Output: List[Dict] - update pipeline
         """
-        try:
-            listing_id = homepage_doc.get("listing_id")
-            
-            # Transform document structure for masterplandata
-            masterplan_doc = {
-                "masterplanlisting_id": listing_id,  # Change from listing_id
-                "scraped_at": homepage_doc.get("scraped_at"),
-                "source_url": homepage_doc.get("source_url"),
-                "masterplan_data": self._transform_property_data(homepage_doc.get("property_data", {})),  # Change from property_data
-                "data_source": homepage_doc.get("data_source"),
-                "listing_status": homepage_doc.get("listing_status"),
-                "last_updated": datetime.now()
-            }
-            
-            # Check if masterplan already exists
-            existing_doc = await self.masterplandata_collection.find_one(
-                {"masterplanlisting_id": listing_id}
-            )
-            
-            if existing_doc:
-                # Update existing masterplan
-                masterplan_doc["previous_scraped_at"] = existing_doc.get("scraped_at")
-                
-                await self.masterplandata_collection.replace_one(
-                    {"masterplanlisting_id": listing_id},
-                    masterplan_doc
-                )
-                logging.info(f"🔄 Updated masterplan: {listing_id}")
-            else:
-                # Insert new masterplan
-                await self.masterplandata_collection.insert_one(masterplan_doc)
-                logging.info(f"🆕 New masterplan: {listing_id}")
-            
-        except Exception as e:
-            logging.error(f"❌ Error processing masterplan community {listing_id}: {e}")
+        return [{"$replaceWith": {"$mergeObjects": [
+            {"previous_scraped_at": "$scraped_at"},
+            {"$literal": new_doc}
+        ]}}]
     
-    async def _process_basiccommunity_community(self, homepage_doc: Dict):
+    async def _flush_special_upserts(self, collection, ops: List[UpdateOne], counts: Dict[str, int]):
         """
-        Process basic community and save to basiccommunitydata collection.
+        Write queued special-community upserts in one unordered bulk_write.
         
-        Input: homepage_doc (Dict) - document from homepagedata
+        Input: collection (AsyncIOMotorCollection), ops (List[UpdateOne]), counts (Dict) - new/updated totals updated in place
         """
+        if not ops:
+            return
+        
         try:
-            listing_id = homepage_doc.get("listing_id")
-            
-            # Transform document structure for basiccommunitydata
-            basiccommunity_doc = {
-                "basic_community_listing_id": listing_id,  # Change from listing_id
-                "scraped_at": homepage_doc.get("scraped_at"),
-                "source_url": homepage_doc.get("source_url"),
-                "basic_community_data": homepage_doc.get("property_data", {}),  # Change from property_data
-                "data_source": homepage_doc.get("data_source"),
-                "listing_status": homepage_doc.get("listing_status"),
-                "last_updated": datetime.now()
-            }
-            
-            # Check if basic community already exists
-            existing_doc = await self.basiccommunitydata_collection.find_one(
-                {"basic_community_listing_id": listing_id}
-            )
-            
-            if existing_doc:
-                # Update existing basic community
-                basiccommunity_doc["previous_scraped_at"] = existing_doc.get("scraped_at")
-                
-                await self.basiccommunitydata_collection.replace_one(
-                    {"basic_community_listing_id": listing_id},
-                    basiccommunity_doc
-                )
-                logging.info(f"🔄 Updated basic community: {listing_id}")
-            else:
-                # Insert new basic community
-                await self.basiccommunitydata_collection.insert_one(basiccommunity_doc)
-                logging.info(f"🆕 New basic community: {listing_id}")
-            
+            result = await collection.bulk_write(ops, ordered=False)
+            counts["new"] += result.upserted_count
+            counts["updated"] += result.matched_count
         except Exception as e:
-            logging.error(f"❌ Error processing basic community {listing_id}: {e}")
+            logging.error(f"❌ Error writing {len(ops)} special communities to {collection.name}: {e}")
     
     def _transform_property_data(self, property_data: Dict) -> Dict:
         """
@@ -240,10 +303,8 @@ class StageOneAndTwoCheck:
             # Get only regular communities (exclude masterplan and basiccommunity)
             cursor = self.homepagedata_collection.find(
                 {
-                    "listing_status": {"$in": ["new", "updated", "active"]},
-                    "listing_id": {
-                        "$not": {"$regex": "masterplan|basiccommunity", "$options": "i"}
-                    }
+                    "community_kind": "regular",
+                    "listing_status": {"$in": ["new", "updated", "active"]}
                 },
                 {
                     "_id": 1, 
@@ -258,13 +319,14 @@ class StageOneAndTwoCheck:
                     "property_data.offers.offeredBy": 1,
                     "property_data.accommodationCategory": 1
                 }
-            )
+            ).batch_size(self.CURSOR_BATCH_SIZE)
             
             async for doc in cursor:
-                if "_id" in doc and "property_data" in doc and "url" in doc["property_data"]:
+                property_data_obj = doc.get("property_data")
+                if "_id" in doc and property_data_obj and "url" in property_data_obj:
                     # Handle both "Address" (capital) and "address" (lowercase) field names
-                    property_data_obj = doc.get("property_data", {})
-                    address_data = property_data_obj.get("Address") or property_data_obj.get("address", {})
+                    address_data = property_data_obj.get("Address") or property_data_obj.get("address") or _EMPTY
+                    offers = property_data_obj.get("offers") or _EMPTY
                     
                     property_data[doc["_id"]] = {
                         "url": property_data_obj["url"],
@@ -272,7 +334,7 @@ class StageOneAndTwoCheck:
                         "county": address_data.get("county"),
                         "addressLocality": address_data.get("addressLocality"),
                         "postalCode": address_data.get("postalCode"),
-                        "offeredBy": property_data_obj.get("offers", {}).get("offeredBy"),
+                        "offeredBy": offers.get("offeredBy"),
                         "accommodationCategory": property_data_obj.get("accommodationCategory")
                     }
             
@@ -287,23 +349,27 @@ class StageOneAndTwoCheck:
         """Handle listings that are missing from current Stage 1 scrape"""
         try:
             # Get current active listings from today's scrape
-            today = datetime.now().date()
-            today_start = datetime.combine(today, datetime.min.time())
+            now = datetime.now()
+            today_start = datetime.combine(now.date(), datetime.min.time())
             tomorrow_start = today_start + timedelta(days=1)
             
-            current_listings = set()
-            async for doc in self.homepagedata_collection.find({
-                "scraped_at": {"$gte": today_start.isoformat(), "$lt": tomorrow_start.isoformat()}
-            }, {"listing_id": 1}):
-                current_listings.add(doc.get("listing_id"))
+            # Id-only docs are small, so drain each scan in bulk rather than resuming per document
+            current_docs = await self.homepagedata_collection.find({
+                "scraped_at": {"$gte": today_start, "$lt": tomorrow_start}
+            }, {"listing_id": 1, "_id": 0}).batch_size(self.CURSOR_BATCH_SIZE).to_list(length=None)
+            current_listings = {doc.get("listing_id") for doc in current_docs}
+            
+            if not current_listings:
+                # Without a Stage 1 scrape today every active listing would look missing
+                logging.info("ℹ️ No Stage 1 listings scraped today - skipping missing listing check")
+                return
             
             # Get all previously active listings
-            previous_listings = set()
-            async for doc in self.homepagedata_collection.find({
+            previous_docs = await self.homepagedata_collection.find({
                 "listing_status": {"$in": ["active", "new", "updated"]},
-                "scraped_at": {"$lt": today_start.isoformat()}
-            }, {"listing_id": 1}):
-                previous_listings.add(doc.get("listing_id"))
+                "scraped_at": {"$lt": today_start}
+            }, {"listing_id": 1, "_id": 0}).batch_size(self.CURSOR_BATCH_SIZE).to_list(length=None)
+            previous_listings = {doc.get("listing_id") for doc in previous_docs}
             
             # Find missing listings
             missing_listings = previous_listings - current_listings
@@ -314,22 +380,28 @@ class StageOneAndTwoCheck:
             
             logging.info(f"📦 Archiving {len(missing_listings)} missing Stage 1 listings")
             
-            # Move missing listings to archive
-            for listing_id in missing_listings:
-                doc = await self.homepagedata_collection.find_one({"listing_id": listing_id})
-                if doc:
-                    # Add archive metadata
-                    doc["listing_status"] = "archived"
-                    doc["archived_at"] = datetime.now()
-                    doc["archive_reason"] = "missing from current Stage 1 scrape"
-                    
-                    # Insert to archive collection
-                    await self.homepagedata_archived_collection.insert_one(doc)
-                    
-                    # Remove from active collection
-                    await self.homepagedata_collection.delete_one({"listing_id": listing_id})
-                    
-                    logging.info(f"📦 Moved {listing_id} to homepagedata_archived")
+            missing_ids = list(missing_listings)
+            
+            # Copy to archive collection server-side (no document bodies over the wire), then remove from active
+            await self.homepagedata_collection.aggregate([
+                {"$match": {"listing_id": {"$in": missing_ids}}},
+                {"$set": {
+                    "listing_status": "archived",
+                    "archived_at": now,
+                    "archive_reason": "missing from current Stage 1 scrape"
+                }},
+                {"$merge": {
+                    "into": {
+                        "db": self.homepagedata_archived_collection.database.name,
+                        "coll": self.homepagedata_archived_collection.name
+                    },
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert"
+                }}
+            ]).to_list(length=None)
+            
+            delete_result = await self.homepagedata_collection.delete_many({"listing_id": {"$in": missing_ids}})
+            logging.info(f"📦 Moved {delete_result.deleted_count} listings to homepagedata_archived")
             
             logging.info(f"✅ Successfully archived {len(missing_listings)} Stage 1 listings")
             
@@ -357,14 +429,16 @@ async def process_stage_one_to_two_routing():
             logging.error("❌ Failed to connect to MongoDB")
             return {}
         
-        # Handle missing Stage 1 listings first
+        # Handle missing Stage 1 listings first - archived listings are deleted from
+        # homepagedata and must not reach either of the reads below
         await checker.handle_missing_stage1_listings()
         
-        # Process Stage 1 results and separate special vs regular communities
-        regular_listings, masterplan_listings, basiccommunity_listings = await checker.process_stage_one_results()
-        
-        # Get regular community data for Stage 2
-        stage2_property_data = await checker.get_regular_communities_for_stage2()
+        # Special-community upserts and the Stage 2 read touch disjoint listings
+        # (community_kind special vs regular), so overlap them on the shared pool
+        (regular_listings, masterplan_listings, basiccommunity_listings), stage2_property_data = await asyncio.gather(
+            checker.process_stage_one_results(),
+            checker.get_regular_communities_for_stage2()
+        )
         
         logging.info(f"📋 Routing Summary:")
         logging.info(f"   ➡️ Stage 2 Properties: {len(stage2_property_data)}")
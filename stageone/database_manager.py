@@ -16,12 +16,14 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 try:
     from ..validation.stage_one_structure_validation import validate_document_structure
+    from ..shared.stage_one_and_two_check import classify_community_kind
 except ImportError:
     # Fallback for when run as script (GitHub Actions)
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from validation.stage_one_structure_validation import validate_document_structure
+    from shared.stage_one_and_two_check import classify_community_kind
 
 load_dotenv()
 
@@ -91,6 +93,9 @@ class DatabaseManager:
                 
             scraped_listing_ids.add(listing_id)
             
+            # Classify once at write time so Stage 2 routing can filter on an indexed equality
+            document["community_kind"] = classify_community_kind(listing_id)
+            
             try:
                 existing_doc = await self.homepagedata_collection.find_one(
                     {"listing_id": listing_id},
@@ -109,11 +114,15 @@ class DatabaseManager:
                             {"listing_id": listing_id}, document
                         )
                         processed_count["updated"] += 1
-                        logging.info(f"🔄 Updated listing: {listing_id}")
+                        logging.debug("🔄 Updated listing: %s", listing_id)
                     else:
                         await self.homepagedata_collection.update_one(
                             {"listing_id": listing_id},
-                            {"$set": {"scraped_at": datetime.now(), "listing_status": "active"}}
+                            {"$set": {
+                                "scraped_at": datetime.now(),
+                                "listing_status": "active",
+                                "community_kind": document["community_kind"]
+                            }}
                         )
                         processed_count["unchanged"] += 1
                 else:
@@ -123,7 +132,7 @@ class DatabaseManager:
                     await self.homepagedata_collection.insert_one(document)
                     processed_count["new"] += 1
                     new_listing_ids.append(listing_id)
-                    logging.info(f"🆕 New listing: {listing_id}")
+                    logging.debug("🆕 New listing: %s", listing_id)
                     
             except Exception as e:
                 logging.error(f"❌ Error processing listing {listing_id}: {e}")
@@ -145,25 +154,30 @@ class DatabaseManager:
         if not missing_listing_ids:
             return 0
             
-        archived_count = 0
-        for listing_id in missing_listing_ids:
-            try:
-                listing = await self.homepagedata_collection.find_one({"listing_id": listing_id})
-                if listing:
-                    listing["archived_at"] = datetime.now()
-                    listing["archive_reason"] = "missing from current scrape"
-                    listing["original_scraped_at"] = listing.get("scraped_at")
-                    
-                    await self.homepagedata_archived_collection.insert_one(listing)
-                    await self.homepagedata_collection.delete_one({"listing_id": listing_id})
-                    
-                    archived_count += 1
-                    logging.info(f"📦 Archived missing listing: {listing_id}")
-                    
-            except Exception as e:
-                logging.error(f"❌ Failed to archive {listing_id}: {e}")
-                
-        return archived_count
+        missing_ids = list(missing_listing_ids)
+        try:
+            # Copy to archive collection server-side (no document bodies over the wire), then remove from active
+            await self.homepagedata_collection.aggregate([
+                {"$match": {"listing_id": {"$in": missing_ids}}},
+                {"$set": {
+                    "archived_at": datetime.now(),
+                    "archive_reason": "missing from current scrape",
+                    "original_scraped_at": "$scraped_at"
+                }},
+                {"$merge": {
+                    "into": self.homepagedata_archived_collection.name,
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert"
+                }}
+            ]).to_list(length=None)
+            
+            result = await self.homepagedata_collection.delete_many({"listing_id": {"$in": missing_ids}})
+            logging.info(f"📦 Archived {result.deleted_count} missing listings")
+            return result.deleted_count
+            
+        except Exception as e:
+            logging.error(f"❌ Failed to archive {len(missing_ids)} missing listings: {e}")
+            return 0
 
     async def store_temp_html(self, doc_id: str, url: str, html: str) -> bool:
         """
@@ -58,7 +58,10 @@ class DataProcessor:
         """
         try:
             existing_data = {}
-            cursor = communitydata_collection.find({}, {"listing_id": 1, "community_data": 1, "scraped_at": 1})
+            # Full-collection scan of small projected docs: larger batches cut getMore round-trips
+            cursor = communitydata_collection.find(
+                {}, {"listing_id": 1, "community_data": 1, "scraped_at": 1}
+            ).batch_size(500)
             
             async for doc in cursor:
                 listing_id = doc.get("listing_id")
@@ -296,33 +299,39 @@ class DataProcessor:
             
             logging.info(f"🗑️ Archiving {len(removed_listing_ids)} removed community listings")
             
-            # Move to archive collection and remove from active
-            for listing_id in removed_listing_ids:
-                # Get the document to archive
-                doc = await communitydata_collection.find_one({"listing_id": listing_id})
-                if doc:
-                    # Add archive metadata
-                    doc["listing_status"] = "archived"
-                    doc["archived_at"] = datetime.now()
-                    doc["archive_reason"] = "missing from current Stage 2 scrape"
-                    
-                    # Insert to archive collection
-                    await communitydata_archived_collection.insert_one(doc)
-                    
-                    # Remove from active collection
-                    await communitydata_collection.delete_one({"listing_id": listing_id})
-                    
-                    logging.info(f"📦 Moved {listing_id} to communitydata_archived")
-                    
-                    # Update price history status to archived
-                    logging.info(f"💰 Updating price history status to archived for {listing_id}")
-                    from ..shared.price_tracker import PriceTracker
-                    price_tracker = PriceTracker()
-                    await price_tracker.connect_to_mongodb()
-                    await price_tracker.update_archived_community_status(listing_id)
-                    price_tracker.close_connection()
-                    logging.info(f"✅ Price history archival completed for {listing_id}")
+            removed_ids = list(removed_listing_ids)
             
+            # Copy to archive collection server-side (no document bodies over the wire), then remove from active
+            await communitydata_collection.aggregate([
+                {"$match": {"listing_id": {"$in": removed_ids}}},
+                {"$set": {
+                    "listing_status": "archived",
+                    "archived_at": datetime.now(),
+                    "archive_reason": "missing from current Stage 2 scrape"
+                }},
+                {"$merge": {
+                    "into": {
+                        "db": communitydata_archived_collection.database.name,
+                        "coll": communitydata_archived_collection.name
+                    },
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert"
+                }}
+            ]).to_list(length=None)
+            
+            delete_result = await communitydata_collection.delete_many({"listing_id": {"$in": removed_ids}})
+            logging.info(f"📦 Moved {delete_result.deleted_count} listings to communitydata_archived")
+            
+            # Update price history status to archived over a single tracker connection
+            logging.info(f"💰 Updating price history status to archived for {len(removed_ids)} listings")
+            from ..shared.price_tracker import PriceTracker
+            price_tracker = PriceTracker()
+            await price_tracker.connect_to_mongodb()
+            try:
+                await price_tracker.update_archived_community_statuses(removed_ids)
+            finally:
+                price_tracker.close_connection()
+            logging.info("✅ Price history archival completed")
             
             logging.info(f"✅ Successfully archived {len(removed_listing_ids)} community listings")
             
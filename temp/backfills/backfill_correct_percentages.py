@@ -156,7 +156,7 @@ class PercentageBackfiller:
             collection = self.db['price_city_snapshot']
             
             result = await collection.update_one(
-                {"city_id": city_id},
+                {"_id": city_id},
                 {
                     "$set": {
                         "current_active_metrics": updated_current_metrics,
@@ -179,7 +179,7 @@ class PriceHistoryBackfiller:
             if new_entries or len(final_timeline) != len(price_timeline):
                 # Update document with deduplicated and backfilled timeline
                 await self.price_history_permanent_collection.update_one(
-                    {"permanent_property_id": permanent_id},
+                    {"_id": permanent_id},
                     {"$set": {"price_timeline": final_timeline}}
                 )
                 
@@ -267,7 +267,7 @@ class PriceHistoryBackfiller:
                 
                 # Upsert city snapshot
                 await self.price_city_snapshot_collection.update_one(
-                    {"city_id": city_id},
+                    {"_id": city_id},
                     {"$set": city_snapshot},
                     upsert=True
                 )
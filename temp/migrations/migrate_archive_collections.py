@@ -20,6 +20,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class ArchiveMigrator:
+    INSERT_BATCH_SIZE = 1000
+    
     def __init__(self):
         self.client = None
         self.newhomesource_db = None
@@ -57,22 +59,30 @@ class ArchiveMigrator:
             
             logging.info(f"🔄 Migrating {doc_count} documents from {source_collection_name} → {target_name}")
             
-            # Get all documents
-            docs = await source_collection.find({}).to_list(length=None)
-            
-            if docs:
+            # Stream documents and insert in unordered chunks (one bad doc doesn't abort the rest, no 16MB command risk)
+            migrated_at = datetime.now()
+            inserted_count = 0
+            chunk = []
+            async for doc in source_collection.find({}).batch_size(self.INSERT_BATCH_SIZE):
                 # Add migration metadata
-                for doc in docs:
-                    doc["migrated_at"] = datetime.now()
-                    doc["migration_source"] = f"newhomesource.{source_collection_name}"
-                
-                # Insert to target
-                await target_collection.insert_many(docs)
-                logging.info(f"✅ Inserted {len(docs)} documents to archived.{target_name}")
+                doc["migrated_at"] = migrated_at
+                doc["migration_source"] = f"newhomesource.{source_collection_name}"
+                chunk.append(doc)
+                if len(chunk) >= self.INSERT_BATCH_SIZE:
+                    result = await target_collection.insert_many(chunk, ordered=False)
+                    inserted_count += len(result.inserted_ids)
+                    chunk = []
+            
+            if chunk:
+                result = await target_collection.insert_many(chunk, ordered=False)
+                inserted_count += len(result.inserted_ids)
+            
+            if inserted_count:
+                logging.info(f"✅ Inserted {inserted_count} documents to archived.{target_name}")
                 
                 # Verify insertion
                 target_count = await target_collection.count_documents({})
-                if target_count >= len(docs):
+                if target_count >= inserted_count:
                     # Delete from source
                     delete_result = await source_collection.delete_many({})
                     logging.info(f"🗑️ Deleted {delete_result.deleted_count} documents from {source_collection_name}")
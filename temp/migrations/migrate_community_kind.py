@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Community Kind Backfill Migration Script
+Stores the Stage 1 routing class on existing homepagedata documents
+
+Migration Plan:
+- homepagedata.community_kind ← "masterplan" / "basiccommunity" / "regular",
+  derived from listing_id exactly as Stage 1 now does at write time
+- Only documents without community_kind are touched, so the script can be re-run
+
+Stage 2 routing filters on community_kind, so listings written before the field
+existed are invisible to it until this has run (or until Stage 1 rescrapes them).
+"""
+
+import asyncio
+import os
+import logging
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _matches(pattern: str) -> dict:
+    """Case-insensitive substring test on listing_id (missing ids never match)"""
+    return {"$regexMatch": {"input": {"$ifNull": ["$listing_id", ""]}, "regex": pattern, "options": "i"}}
+
+
+# Same precedence as classify_community_kind: masterplan wins over basiccommunity
+COMMUNITY_KIND_PIPELINE = [
+    {"$set": {"community_kind": {"$switch": {
+        "branches": [
+            {"case": _matches("masterplan"), "then": "masterplan"},
+            {"case": _matches("basiccommunity"), "then": "basiccommunity"}
+        ],
+        "default": "regular"
+    }}}}
+]
+
+
+class CommunityKindMigrator:
+    def __init__(self):
+        self.client = None
+        self.db = None
+
+    async def connect(self):
+        """Connect to MongoDB"""
+        try:
+            uri = os.getenv("MONGO_DB_URI")
+            self.client = AsyncIOMotorClient(uri)
+            self.db = self.client['newhomesource']
+
+            # Test connection
+            await self.client.admin.command('ping')
+            logging.info("✅ Connected to MongoDB")
+            return True
+        except Exception as e:
+            logging.error(f"❌ MongoDB connection failed: {e}")
+            return False
+
+    async def run_migration(self, dry_run: bool = False):
+        """Backfill community_kind on every homepagedata document missing it"""
+        if not await self.connect():
+            return False
+
+        logging.info(f"🚀 Starting community_kind backfill {'(DRY RUN)' if dry_run else ''}")
+        collection = self.db['homepagedata']
+        missing_filter = {"community_kind": {"$exists": False}}
+
+        try:
+            if dry_run:
+                pending = await collection.count_documents(missing_filter)
+                logging.info(f"🔍 Would classify {pending} homepagedata documents")
+            else:
+                # One server-side pass; no documents cross the wire
+                result = await collection.update_many(missing_filter, COMMUNITY_KIND_PIPELINE)
+                logging.info(f"✅ Classified {result.modified_count} homepagedata documents")
+
+            async for row in collection.aggregate([
+                {"$group": {"_id": "$community_kind", "count": {"$sum": 1}}}
+            ]):
+                logging.info(f"   📊 {row['_id'] or 'unclassified'}: {row['count']}")
+
+        except Exception as e:
+            logging.error(f"❌ Error backfilling community_kind: {e}")
+            self.client.close()
+            return False
+
+        logging.info("📊 MIGRATION COMPLETE")
+        self.client.close()
+        return True
+
+
+def setup_logging():
+    """Setup logging configuration"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filename = f"community_kind_migration_log_{timestamp}.log"
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_filename),
+            logging.StreamHandler()
+        ]
+    )
+    return log_filename
+
+
+async def main():
+    """Main execution function"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Backfill homepagedata.community_kind from listing_id')
+    parser.add_argument('--dry-run', action='store_true', help='Run in dry-run mode (no actual changes)')
+    args = parser.parse_args()
+
+    log_file = setup_logging()
+    migrator = CommunityKindMigrator()
+    success = await migrator.run_migration(dry_run=args.dry_run)
+
+    print(f"📋 Migration log: {log_file}")
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    exit(exit_code)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Permanent ID Primary Key Migration Script
+Re-keys price collections so the deterministic hash is stored as _id
+
+Migration Plan:
+- price_history_permanent: _id ← permanent_property_id
+- price_city_snapshot: _id ← city_id
+- Drop the now-redundant permanent_property_id / city_id secondary indexes
+
+_id is immutable in MongoDB, so each document is re-inserted under its new
+key and the ObjectId-keyed original is deleted afterwards.
+
+Deploy order: run this BEFORE deploying the PriceTracker that upserts by _id,
+with the pipeline stopped. If the new code has already run, it will have created
+hash-keyed records next to the ObjectId-keyed ones; those are merged here
+(the older document's history is folded into the hash-keyed one) rather than lost.
+"""
+
+import asyncio
+import os
+import logging
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ObjectId-keyed documents fetched per $in round-trip
+REKEY_BATCH_SIZE = 500
+
+
+def _entry_date(entry: dict) -> datetime:
+    """Timeline entry date as a datetime (older records stored ISO strings)"""
+    date = entry.get("date")
+    return datetime.fromisoformat(date) if isinstance(date, str) else date
+
+
+def merge_price_history(existing: dict, old: dict) -> dict:
+    """
+    Update folding an ObjectId-keyed price_history_permanent document into its hash-keyed duplicate.
+    
+    Timeline entries older than the duplicate's first entry are prepended, fields only the old
+    document has are copied over, and running_sum is dropped so the next Stage 2 run re-derives
+    aggregated_metrics from the merged timeline.
+    """
+    timeline = existing.get("price_timeline", [])
+    first_date = min((_entry_date(e) for e in timeline), default=None)
+    older_entries = [e for e in old.get("price_timeline", []) if first_date is None or _entry_date(e) < first_date]
+    
+    fields = {key: value for key, value in old.items() if key not in existing and key != "_id"}
+    fields["price_timeline"] = sorted(older_entries, key=_entry_date) + timeline
+    if isinstance(old.get("created_at"), datetime) and isinstance(existing.get("created_at"), datetime):
+        fields["created_at"] = min(old["created_at"], existing["created_at"])
+    
+    return {"$set": fields, "$unset": {"aggregated_metrics.running_sum": ""}}
+
+
+def merge_city_snapshot(existing: dict, old: dict) -> dict:
+    """
+    Update folding an ObjectId-keyed price_city_snapshot document into its hash-keyed duplicate.
+    
+    Daily averages are combined by date (the hash-keyed document wins on a shared date) and
+    trimmed to the 30 days PriceTracker keeps; fields only the old document has are copied over.
+    """
+    by_date = {entry["date"]: entry for entry in old.get("historical_daily_averages", [])}
+    by_date.update({entry["date"]: entry for entry in existing.get("historical_daily_averages", [])})
+    
+    fields = {key: value for key, value in old.items() if key not in existing and key != "_id"}
+    fields["historical_daily_averages"] = sorted(by_date.values(), key=lambda x: x["date"])[-30:]
+    return {"$set": fields}
+
+
+class PermanentIdMigrator:
+    def __init__(self):
+        self.client = None
+        self.db = None
+        self.stats = {"rekeyed": 0, "merged": 0, "already_keyed": 0, "errors": 0}
+
+    async def connect(self):
+        """Connect to MongoDB"""
+        try:
+            uri = os.getenv("MONGO_DB_URI")
+            self.client = AsyncIOMotorClient(uri)
+            self.db = self.client['newhomesource']
+
+            # Test connection
+            await self.client.admin.command('ping')
+            logging.info("✅ Connected to MongoDB")
+            return True
+        except Exception as e:
+            logging.error(f"❌ MongoDB connection failed: {e}")
+            return False
+
+    async def migrate_collection(self, collection_name: str, key_field: str, merge, dry_run: bool = False):
+        """Re-key every ObjectId-keyed document in collection_name so that _id == key_field"""
+        collection = self.db[collection_name]
+        errors_before = self.stats["errors"]
+
+        try:
+            # Snapshot the ids to re-key up front; the cursor must not see the documents re-inserted below
+            old_ids = await collection.distinct("_id", {"_id": {"$type": "objectId"}, key_field: {"$exists": True}})
+            self.stats["already_keyed"] += await collection.count_documents({"_id": {"$type": "string"}})
+            logging.info(f"🔑 {collection_name}: {len(old_ids)} ObjectId-keyed documents to re-key")
+
+            for i in range(0, len(old_ids), REKEY_BATCH_SIZE):
+                async for doc in collection.find({"_id": {"$in": old_ids[i:i + REKEY_BATCH_SIZE]}}):
+                    await self._rekey_document(collection, doc, key_field, merge, dry_run)
+
+            if dry_run:
+                return
+
+            if self.stats["errors"] > errors_before:
+                logging.warning(f"⚠️ Keeping {key_field} index on {collection_name}: re-keying had errors, rerun the migration")
+                return
+
+            index_info = await collection.index_information()
+            for index_name, spec in index_info.items():
+                if spec.get("key") == [(key_field, 1)]:
+                    await collection.drop_index(index_name)
+                    logging.info(f"🗑️ Dropped redundant index {index_name} on {collection_name}")
+
+        except Exception as e:
+            logging.error(f"❌ Error migrating {collection_name}: {e}")
+            self.stats["errors"] += 1
+
+    async def _rekey_document(self, collection, doc: dict, key_field: str, merge, dry_run: bool):
+        """Insert doc under its key_field as _id (merging into an existing hash-keyed duplicate), then delete the original"""
+        old_id = doc.pop("_id")
+        new_id = doc[key_field]
+
+        try:
+            if dry_run:
+                if await collection.count_documents({"_id": new_id}, limit=1):
+                    logging.info(f"🔍 Would merge {collection.name} {old_id} into existing {new_id}")
+                    self.stats["merged"] += 1
+                else:
+                    logging.info(f"🔍 Would re-key {collection.name} {old_id} → {new_id}")
+                    self.stats["rekeyed"] += 1
+                return
+
+            try:
+                await collection.insert_one({"_id": new_id, **doc})
+                self.stats["rekeyed"] += 1
+            except DuplicateKeyError:
+                # The _id-keyed PriceTracker already created this record; fold the old one into it
+                existing = await collection.find_one({"_id": new_id})
+                await collection.update_one({"_id": new_id}, merge(existing, doc))
+                logging.info(f"🔀 Merged {collection.name} {old_id} into existing {new_id}")
+                self.stats["merged"] += 1
+
+            await collection.delete_one({"_id": old_id})
+        except Exception as e:
+            logging.error(f"❌ Error re-keying {collection.name} {old_id}: {e}")
+            self.stats["errors"] += 1
+
+    async def run_migration(self, dry_run: bool = False):
+        """Execute all primary key migrations"""
+        if not await self.connect():
+            return False
+
+        logging.info(f"🚀 Starting permanent ID migration {'(DRY RUN)' if dry_run else ''}")
+
+        await self.migrate_collection("price_history_permanent", "permanent_property_id", merge_price_history, dry_run)
+        await self.migrate_collection("price_city_snapshot", "city_id", merge_city_snapshot, dry_run)
+
+        logging.info("📊 MIGRATION COMPLETE")
+        logging.info(f"   🔑 Re-keyed: {self.stats['rekeyed']}")
+        logging.info(f"   🔀 Merged into existing: {self.stats['merged']}")
+        logging.info(f"   ✅ Already keyed: {self.stats['already_keyed']}")
+        logging.info(f"   ❌ Errors: {self.stats['errors']}")
+
+        self.client.close()
+        return self.stats["errors"] == 0
+
+
+def setup_logging():
+    """Setup logging configuration"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filename = f"permanent_id_migration_log_{timestamp}.log"
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_filename),
+            logging.StreamHandler()
+        ]
+    )
+    return log_filename
+
+
+async def main():
+    """Main execution function"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Store permanent_property_id / city_id as _id')
+    parser.add_argument('--dry-run', action='store_true', help='Run in dry-run mode (no actual changes)')
+    args = parser.parse_args()
+
+    log_file = setup_logging()
+    migrator = PermanentIdMigrator()
+    success = await migrator.run_migration(dry_run=args.dry_run)
+
+    print(f"📋 Migration log: {log_file}")
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    exit(exit_code)
@@ -82,7 +82,7 @@ class ArchivedStatusSyncer:
                 
                 # Check if record exists in price_history_permanent
                 existing_record = await price_history_collection.find_one(
-                    {"permanent_property_id": permanent_id}
+                    {"_id": permanent_id}
                 )
                 
                 if not existing_record:
@@ -100,7 +100,7 @@ class ArchivedStatusSyncer:
                 
                 # Update to archived status
                 result = await price_history_collection.update_one(
-                    {"permanent_property_id": permanent_id},
+                    {"_id": permanent_id},
                     {"$set": {
                         "listing_status": "archived",
                         "archived_at": datetime.now(),
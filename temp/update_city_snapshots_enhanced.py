@@ -7,7 +7,9 @@ Usage: python update_city_snapshots_enhanced.py
 import asyncio
 import os
 import logging
+from bisect import bisect_left
 from datetime import datetime, timedelta
+from operator import itemgetter
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 import hashlib
@@ -109,7 +111,7 @@ class EnhancedCitySnapshotUpdater:
             
             # Upsert city snapshot
             await self.db['price_city_snapshot'].update_one(
-                {"city_id": city_id},
+                {"_id": city_id},
                 {"$set": city_snapshot},
                 upsert=True
             )
@@ -159,13 +161,21 @@ class EnhancedCitySnapshotUpdater:
             "yearly_trends": self._calculate_yearly_trends(all_prices, current_avg, current_date)
         }
     
+    def _window_average(self, all_prices, start_date, end_date=None):
+        """Average price in [start_date, end_date) of date-sorted all_prices, bisecting instead of scanning"""
+        lo = bisect_left(all_prices, start_date, key=itemgetter(0))
+        hi = bisect_left(all_prices, end_date, key=itemgetter(0)) if end_date is not None else len(all_prices)
+        if hi <= lo:
+            return None
+        return sum(price for _, price in all_prices[lo:hi]) / (hi - lo)
+    
     def _calculate_moving_averages(self, all_prices, current_date):
         """Calculate moving averages for multiple time periods"""
         averages = {}
         for days in [1, 7, 14, 30, 60, 90, 180, 365]:
             cutoff_date = current_date - timedelta(days=days)
-            recent_prices = [price for date, price in all_prices if date >= cutoff_date]
-            averages[f"{days}_day_average"] = round(sum(recent_prices) / len(recent_prices), 2) if recent_prices else None
+            recent_avg = self._window_average(all_prices, cutoff_date)
+            averages[f"{days}_day_average"] = round(recent_avg, 2) if recent_avg is not None else None
         return averages
     
     def _calculate_percent_changes(self, all_prices, current_avg, current_date):
@@ -173,9 +183,8 @@ class EnhancedCitySnapshotUpdater:
         changes = {}
         for days in [1, 7, 14, 30, 60, 90, 180, 365]:
             cutoff_date = current_date - timedelta(days=days)
-            past_prices = [price for date, price in all_prices if cutoff_date - timedelta(days=1) <= date < cutoff_date]
-            if past_prices:
-                past_avg = sum(past_prices) / len(past_prices)
+            past_avg = self._window_average(all_prices, cutoff_date - timedelta(days=1), cutoff_date)
+            if past_avg is not None:
                 change = ((current_avg - past_avg) / past_avg * 100) if past_avg > 0 else 0
                 changes[f"{days}_day_change"] = round(change, 2)
             else:
@@ -187,9 +196,8 @@ class EnhancedCitySnapshotUpdater:
         trends = {}
         for weeks in [1, 2, 4, 8, 12]:
             cutoff_date = current_date - timedelta(weeks=weeks)
-            period_prices = [price for date, price in all_prices if date >= cutoff_date]
-            if period_prices:
-                avg_price = sum(period_prices) / len(period_prices)
+            avg_price = self._window_average(all_prices, cutoff_date)
+            if avg_price is not None:
                 change = ((current_avg - avg_price) / avg_price * 100) if avg_price > 0 else 0
                 trends[f"{weeks}_week_change"] = round(change, 2)
             else:
@@ -201,9 +209,8 @@ class EnhancedCitySnapshotUpdater:
         trends = {}
         for months in [1, 3, 6, 12]:
             cutoff_date = current_date - timedelta(days=months*30)
-            period_prices = [price for date, price in all_prices if date >= cutoff_date]
-            if period_prices:
-                avg_price = sum(period_prices) / len(period_prices)
+            avg_price = self._window_average(all_prices, cutoff_date)
+            if avg_price is not None:
                 change = ((current_avg - avg_price) / avg_price * 100) if avg_price > 0 else 0
                 trends[f"{months}_month_change"] = round(change, 2)
             else:
@@ -215,9 +222,8 @@ class EnhancedCitySnapshotUpdater:
         trends = {}
         for years in [1, 2, 3]:
             cutoff_date = current_date - timedelta(days=years*365)
-            period_prices = [price for date, price in all_prices if date >= cutoff_date]
-            if period_prices:
-                avg_price = sum(period_prices) / len(period_prices)
+            avg_price = self._window_average(all_prices, cutoff_date)
+            if avg_price is not None:
                 change = ((current_avg - avg_price) / avg_price * 100) if avg_price > 0 else 0
                 trends[f"{years}_year_change"] = round(change, 2)
             else:
@@ -200,7 +200,7 @@ class PriceHistoryAddressUpdater:
         """Update a price_history_permanent record with new address data"""
         try:
             result = await self.price_history_permanent_collection.update_one(
-                {"permanent_property_id": permanent_id},
+                {"_id": permanent_id},
                 {
                     "$set": {
                         "address": address_data,
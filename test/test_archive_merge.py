@@ -0,0 +1,166 @@
+"""
+Test Archive Merge Paths
+Tests the server-side $merge + delete_many archives of removed Stage 1 and Stage 2 listings
+"""
+
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stagetwo.data_processor import DataProcessor
+from stageone.database_manager import DatabaseManager
+
+
+def mock_source_collection(deleted_count: int) -> MagicMock:
+    """Active collection whose aggregate() cursor drains to nothing and whose delete_many reports deleted_count"""
+    collection = MagicMock()
+    collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+    collection.delete_many = AsyncMock(return_value=MagicMock(deleted_count=deleted_count))
+    return collection
+
+
+def mock_archive_collection(db_name: str, collection_name: str) -> MagicMock:
+    """Archive collection exposing only its name and database name"""
+    collection = MagicMock()
+    collection.name = collection_name
+    collection.database.name = db_name
+    return collection
+
+
+class TestStageTwoRemovedListingArchive:
+    """Test archiving communitydata listings missing from the current Stage 2 scrape"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        with patch.dict(os.environ, {"MONGO_DB_URI": "mongodb://localhost:27017"}):
+            self.processor = DataProcessor()
+        
+        self.communitydata_collection = mock_source_collection(deleted_count=1)
+        self.communitydata_archived_collection = mock_archive_collection("archived", "communitydata_archived")
+        
+        self.existing_ids = {
+            "https://www.newhomesource.com/community/ca/ventura/sunset-village",
+            "https://www.newhomesource.com/community/ca/riverside/old-orchard",
+            "https://www.newhomesource.com/community/ca/temecula/vine-ridge"
+        }
+        self.removed_id = "https://www.newhomesource.com/community/ca/riverside/old-orchard"
+    
+    async def archive(self, processed_ids):
+        """Run handle_removed_listings against the mocked collections"""
+        await self.processor.handle_removed_listings(
+            self.existing_ids, processed_ids,
+            self.communitydata_collection, self.communitydata_archived_collection
+        )
+    
+    @pytest.mark.asyncio
+    async def test_removed_listings_merged_then_deleted(self):
+        """Test that removed listings are copied with one $merge and removed with one delete_many"""
+        await self.archive(self.existing_ids - {self.removed_id})
+        
+        pipeline = self.communitydata_collection.aggregate.call_args[0][0]
+        assert len(pipeline) == 3
+        assert pipeline[0] == {"$match": {"listing_id": {"$in": [self.removed_id]}}}
+        
+        archive_fields = pipeline[1]["$set"]
+        assert archive_fields["listing_status"] == "archived"
+        assert archive_fields["archive_reason"] == "missing from current Stage 2 scrape"
+        assert isinstance(archive_fields["archived_at"], datetime)
+        
+        assert pipeline[2] == {"$merge": {
+            "into": {"db": "archived", "coll": "communitydata_archived"},
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+        
+        self.communitydata_collection.delete_many.assert_awaited_once_with({"listing_id": {"$in": [self.removed_id]}})
+    
+    @pytest.mark.asyncio
+    async def test_nothing_archived_when_no_listing_removed(self):
+        """Test that no archive round-trips are made when every listing was processed"""
+        await self.archive(set(self.existing_ids))
+        
+        self.communitydata_collection.aggregate.assert_not_called()
+        self.communitydata_collection.delete_many.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_mass_removal_skipped(self):
+        """Test that the safety check skips archiving when more than half the listings would be removed"""
+        await self.archive({self.removed_id})
+        
+        self.communitydata_collection.aggregate.assert_not_called()
+        self.communitydata_collection.delete_many.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_failed_merge_keeps_listings(self):
+        """Test that listings are not deleted when the $merge copy fails"""
+        self.communitydata_collection.aggregate.return_value.to_list = AsyncMock(side_effect=Exception("merge failed"))
+        
+        await self.archive(self.existing_ids - {self.removed_id})
+        
+        self.communitydata_collection.delete_many.assert_not_called()
+
+
+class TestStageOneMissingListingArchive:
+    """Test archiving homepagedata listings missing from the current Stage 1 scrape"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.db_manager = DatabaseManager()
+        self.db_manager.homepagedata_collection = mock_source_collection(deleted_count=2)
+        self.db_manager.homepagedata_archived_collection = mock_archive_collection("newhomesource", "homepagedata_archived")
+        
+        self.missing_ids = {
+            "https://www.newhomesource.com/community/ca/riverside/old-orchard",
+            "https://www.newhomesource.com/community/ca/temecula/vine-ridge"
+        }
+    
+    @pytest.mark.asyncio
+    async def test_missing_listings_merged_then_deleted(self):
+        """Test that missing listings are copied with one $merge, removed with one delete_many and counted"""
+        archived_count = await self.db_manager.archive_missing_listings(self.missing_ids)
+        
+        assert archived_count == 2
+        
+        pipeline = self.db_manager.homepagedata_collection.aggregate.call_args[0][0]
+        assert len(pipeline) == 3
+        assert sorted(pipeline[0]["$match"]["listing_id"]["$in"]) == sorted(self.missing_ids)
+        
+        archive_fields = pipeline[1]["$set"]
+        assert archive_fields["archive_reason"] == "missing from current scrape"
+        assert archive_fields["original_scraped_at"] == "$scraped_at"
+        assert isinstance(archive_fields["archived_at"], datetime)
+        
+        assert pipeline[2] == {"$merge": {
+            "into": "homepagedata_archived",
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+        
+        delete_filter = self.db_manager.homepagedata_collection.delete_many.call_args[0][0]
+        assert sorted(delete_filter["listing_id"]["$in"]) == sorted(self.missing_ids)
+    
+    @pytest.mark.asyncio
+    async def test_no_missing_listings(self):
+        """Test that an empty set makes no round-trips"""
+        assert await self.db_manager.archive_missing_listings(set()) == 0
+        
+        self.db_manager.homepagedata_collection.aggregate.assert_not_called()
+        self.db_manager.homepagedata_collection.delete_many.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_failed_merge_keeps_listings(self):
+        """Test that listings are not deleted, and none counted, when the $merge copy fails"""
+        self.db_manager.homepagedata_collection.aggregate.return_value.to_list = AsyncMock(side_effect=Exception("merge failed"))
+        
+        assert await self.db_manager.archive_missing_listings(self.missing_ids) == 0
+        
+        self.db_manager.homepagedata_collection.delete_many.assert_not_called()
+
+
+if __name__ == "__main__":
+    # Run tests directly
+    pytest.main([__file__, "-v"])
@@ -6,7 +6,7 @@ Tests the city-level price aggregation logic, especially condominium handling
 import asyncio
 import pytest
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, MagicMock, patch
 import sys
 import os
@@ -27,6 +27,14 @@ class TestCitySnapshotAggregation:
         self.price_tracker.price_history_permanent_collection = AsyncMock()
         self.price_tracker.price_city_snapshot_collection = AsyncMock()
         
+        # aggregate() returns a cursor synchronously; its results are streamed with async for
+        self.price_tracker.price_history_permanent_collection.aggregate = MagicMock()
+        self.set_aggregation_result([])
+        
+        # No existing city snapshots to preserve historical counts from
+        self.price_tracker.price_city_snapshot_collection.find = MagicMock()
+        self.price_tracker.price_city_snapshot_collection.find.return_value.to_list = AsyncMock(return_value=[])
+        
         # Sample data based on provided examples
         self.sample_permanent_records = [
             {
@@ -123,6 +131,19 @@ class TestCitySnapshotAggregation:
             }
         ]
     
+    def set_aggregation_result(self, results):
+        """Make the mocked aggregation cursor yield the given city documents"""
+        async def cursor():
+            for result in results:
+                yield result
+        
+        self.price_tracker.price_history_permanent_collection.aggregate.return_value.__aiter__ = lambda _: cursor()
+    
+    def get_written_city_snapshots(self):
+        """Collect (filter, replacement) pairs from the city snapshot bulk_write calls"""
+        bulk_calls = self.price_tracker.price_city_snapshot_collection.bulk_write.call_args_list
+        return [(op._filter, op._doc) for call in bulk_calls for op in call[0][0]]
+    
     def mock_aggregation_pipeline_result(self):
         """Mock the MongoDB aggregation pipeline result"""
         return [
@@ -130,7 +151,7 @@ class TestCitySnapshotAggregation:
                 "_id": {
                     "city": "Ventura",
                     "county": "Ventura County", 
-                    "postal_code": "93004"
+                    "addressRegion": "CA"
                 },
                 "properties": [
                     {
@@ -151,7 +172,7 @@ class TestCitySnapshotAggregation:
                 "_id": {
                     "city": "Beaumont",
                     "county": "Riverside County",
-                    "postal_code": "92223"
+                    "addressRegion": "CA"
                 },
                 "properties": [
                     {
@@ -176,7 +197,7 @@ class TestCitySnapshotAggregation:
         
         # Mock the aggregation pipeline
         mock_aggregation_result = self.mock_aggregation_pipeline_result()
-        self.price_tracker.price_history_permanent_collection.aggregate.return_value.to_list.return_value = mock_aggregation_result
+        self.set_aggregation_result(mock_aggregation_result)
         
         # Mock the helper methods
         with patch.object(self.price_tracker, '_calculate_historical_daily_averages', return_value=[]):
@@ -186,16 +207,12 @@ class TestCitySnapshotAggregation:
                     # Execute the method
                     await self.price_tracker._create_city_price_snapshots()
         
-        # Verify that update_one was called for each city
-        assert self.price_tracker.price_city_snapshot_collection.update_one.call_count == 2
-        
-        # Extract the calls made to update_one
-        calls = self.price_tracker.price_city_snapshot_collection.update_one.call_args_list
+        # Verify that a replacement was written for each city
+        written = self.get_written_city_snapshots()
+        assert len(written) == 2
         
         # Test Ventura city data
-        ventura_call = calls[0]
-        ventura_filter, ventura_update = ventura_call[0]
-        ventura_snapshot = ventura_update["$set"]
+        ventura_filter, ventura_snapshot = written[0]
         
         assert ventura_snapshot["addressLocality"] == "Ventura"
         assert ventura_snapshot["county"] == "Ventura County"
@@ -216,9 +233,7 @@ class TestCitySnapshotAggregation:
         assert overall_metrics["avg_price"] == (1360919 + 750000) / 2
         
         # Test Beaumont city data
-        beaumont_call = calls[1]
-        beaumont_filter, beaumont_update = beaumont_call[0]
-        beaumont_snapshot = beaumont_update["$set"]
+        beaumont_filter, beaumont_snapshot = written[1]
         
         assert beaumont_snapshot["addressLocality"] == "Beaumont"
         assert beaumont_snapshot["county"] == "Riverside County"
@@ -243,7 +258,7 @@ class TestCitySnapshotAggregation:
                 "_id": {
                     "city": "TestCity",
                     "county": "Test County",
-                    "postal_code": "12345"
+                    "addressRegion": "CA"
                 },
                 "properties": [
                     {
@@ -256,7 +271,7 @@ class TestCitySnapshotAggregation:
             }
         ]
         
-        self.price_tracker.price_history_permanent_collection.aggregate.return_value.to_list.return_value = mock_result
+        self.set_aggregation_result(mock_result)
         
         with patch.object(self.price_tracker, '_calculate_historical_daily_averages', return_value=[]):
             with patch.object(self.price_tracker, '_calculate_property_metrics', return_value={"moving_averages": {}, "percent_changes": {}}):
@@ -264,12 +279,11 @@ class TestCitySnapshotAggregation:
                     
                     await self.price_tracker._create_city_price_snapshots()
         
-        # Verify update was called
-        assert self.price_tracker.price_city_snapshot_collection.update_one.call_count == 1
+        # Verify a replacement was written
+        written = self.get_written_city_snapshots()
+        assert len(written) == 1
         
-        call = self.price_tracker.price_city_snapshot_collection.update_one.call_args_list[0]
-        _, update = call[0]
-        snapshot = update["$set"]
+        _, snapshot = written[0]
         
         # Check that condo metrics are properly null/zero
         condo_metrics = snapshot["current_active_metrics"]["condo"]
@@ -286,7 +300,7 @@ class TestCitySnapshotAggregation:
                 "_id": {
                     "city": "TestCity",
                     "county": "Test County", 
-                    "postal_code": "12345"
+                    "addressRegion": "CA"
                 },
                 "properties": [
                     {
@@ -305,7 +319,7 @@ class TestCitySnapshotAggregation:
             }
         ]
         
-        self.price_tracker.price_history_permanent_collection.aggregate.return_value.to_list.return_value = mock_result
+        self.set_aggregation_result(mock_result)
         
         with patch.object(self.price_tracker, '_calculate_historical_daily_averages', return_value=[]):
             with patch.object(self.price_tracker, '_calculate_property_metrics', return_value={"moving_averages": {}, "percent_changes": {}}):
@@ -313,9 +327,7 @@ class TestCitySnapshotAggregation:
                     
                     await self.price_tracker._create_city_price_snapshots()
         
-        call = self.price_tracker.price_city_snapshot_collection.update_one.call_args_list[0]
-        _, update = call[0]
-        snapshot = update["$set"]
+        _, snapshot = self.get_written_city_snapshots()[0]
         
         # Verify archived condo is not counted in active metrics
         condo_metrics = snapshot["current_active_metrics"]["condo"]
@@ -337,7 +349,7 @@ class TestCitySnapshotAggregation:
                 "_id": {
                     "city": "TestCity", 
                     "county": "Test County",
-                    "postal_code": "12345"
+                    "addressRegion": "CA"
                 },
                 "properties": [
                     {
@@ -368,7 +380,7 @@ class TestCitySnapshotAggregation:
             }
         ]
         
-        self.price_tracker.price_history_permanent_collection.aggregate.return_value.to_list.return_value = mock_result
+        self.set_aggregation_result(mock_result)
         
         with patch.object(self.price_tracker, '_calculate_historical_daily_averages', return_value=[]):
             with patch.object(self.price_tracker, '_calculate_property_metrics', return_value={"moving_averages": {}, "percent_changes": {}}):
@@ -376,9 +388,7 @@ class TestCitySnapshotAggregation:
                     
                     await self.price_tracker._create_city_price_snapshots()
         
-        call = self.price_tracker.price_city_snapshot_collection.update_one.call_args_list[0]
-        _, update = call[0]
-        snapshot = update["$set"]
+        _, snapshot = self.get_written_city_snapshots()[0]
         
         # Only exact matches should be counted
         condo_metrics = snapshot["current_active_metrics"]["condo"]
@@ -394,6 +404,133 @@ class TestCitySnapshotAggregation:
         assert overall_metrics["total_properties"] == 4, "All active properties should be counted in overall"
 
 
+
+class TestHistoricalDailyAverages:
+    """Test the per-day listing counts and average prices built from property timelines"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.price_tracker = PriceTracker()
+        
+        # Known timelines over 2025-01-10 .. 2025-01-12
+        self.properties = [
+            {
+                "accommodation_category": "Single Family Residence",
+                "price_timeline": [
+                    {"date": datetime(2025, 1, 10, 8, 0), "price": 500000},
+                    {"date": datetime(2025, 1, 12, 9, 0), "price": 520000}
+                ]
+            },
+            {
+                "accommodation_category": "Single Family Residence",
+                "price_timeline": [
+                    {"date": datetime(2025, 1, 11, 10, 0), "price": 600000}
+                ]
+            },
+            {
+                "accommodation_category": "Condominium",
+                "price_timeline": [
+                    {"date": "2025-01-10T12:00:00", "price": 300000},  # Legacy ISO string date
+                    # Same-day entries stored out of order: the later timestamp must win
+                    {"date": datetime(2025, 1, 11, 18, 0), "price": 320000},
+                    {"date": datetime(2025, 1, 11, 7, 0), "price": 310000}
+                ]
+            },
+            {
+                "accommodation_category": "Condominium",
+                "price_timeline": [
+                    {"date": datetime(2025, 1, 12, 12, 0), "price": 0}  # No price yet - never counted
+                ]
+            }
+        ]
+    
+    def get_days(self, properties):
+        """Daily averages keyed by date"""
+        return {day["date"]: day for day in self.price_tracker._calculate_historical_daily_averages_sync(properties)}
+    
+    def test_counts_and_averages_per_day(self):
+        """Test listing counts and average prices for every day in the timelines"""
+        days = self.get_days(self.properties)
+        
+        assert list(days) == ["2025-01-10", "2025-01-11", "2025-01-12"]
+        
+        assert days["2025-01-10"] == {
+            "date": "2025-01-10",
+            "sfr_avg_price": 500000.0, "sfr_listing_count": 1,
+            "condo_avg_price": 300000.0, "condo_listing_count": 1,
+            "overall_avg_price": 400000.0, "overall_listing_count": 2
+        }
+        assert days["2025-01-11"] == {
+            "date": "2025-01-11",
+            "sfr_avg_price": 550000.0, "sfr_listing_count": 2,
+            "condo_avg_price": 320000.0, "condo_listing_count": 1,
+            "overall_avg_price": 473333.33, "overall_listing_count": 3
+        }
+        assert days["2025-01-12"] == {
+            "date": "2025-01-12",
+            "sfr_avg_price": 560000.0, "sfr_listing_count": 2,
+            "condo_avg_price": 320000.0, "condo_listing_count": 1,
+            "overall_avg_price": 480000.0, "overall_listing_count": 3
+        }
+    
+    def test_latest_same_day_entry_by_time_wins(self):
+        """Test that the latest entry of a day is used regardless of the order it was stored in"""
+        in_order = [{
+            "accommodation_category": "Condominium",
+            "price_timeline": [
+                {"date": datetime(2025, 1, 11, 7, 0), "price": 310000},
+                {"date": datetime(2025, 1, 11, 18, 0), "price": 320000}
+            ]
+        }]
+        out_of_order = [{
+            "accommodation_category": "Condominium",
+            "price_timeline": list(reversed(in_order[0]["price_timeline"]))
+        }]
+        
+        assert self.get_days(in_order)["2025-01-11"]["condo_avg_price"] == 320000.0
+        assert self.get_days(out_of_order)["2025-01-11"]["condo_avg_price"] == 320000.0
+    
+    def test_property_dropping_to_zero_is_not_counted(self):
+        """Test that a property whose latest price is zero is left out of that day's counts"""
+        properties = [{
+            "accommodation_category": "Single Family Residence",
+            "price_timeline": [
+                {"date": datetime(2025, 1, 10, 8, 0), "price": 500000},
+                {"date": datetime(2025, 1, 11, 8, 0), "price": 0}
+            ]
+        }]
+        
+        days = self.get_days(properties)
+        
+        assert days["2025-01-10"]["sfr_listing_count"] == 1
+        assert days["2025-01-11"]["sfr_listing_count"] == 0
+        assert days["2025-01-11"]["sfr_avg_price"] is None
+    
+    def test_only_last_30_days_returned(self):
+        """Test that only the 30 most recent dates are returned"""
+        properties = [{
+            "accommodation_category": "Single Family Residence",
+            "price_timeline": [
+                {"date": datetime(2025, 1, 1) + timedelta(days=i), "price": 500000 + i}
+                for i in range(40)
+            ]
+        }]
+        
+        daily_averages = self.price_tracker._calculate_historical_daily_averages_sync(properties)
+        
+        assert len(daily_averages) == 30
+        assert daily_averages[0]["date"] == "2025-01-11"
+        assert daily_averages[0]["sfr_avg_price"] == 500010.0
+        assert daily_averages[-1]["date"] == "2025-02-09"
+    
+    @pytest.mark.asyncio
+    async def test_async_wrapper_matches_sync(self):
+        """Test that the threaded wrapper returns the same result"""
+        expected = self.price_tracker._calculate_historical_daily_averages_sync(self.properties)
+        
+        assert await self.price_tracker._calculate_historical_daily_averages(self.properties) == expected
+
+
 if __name__ == "__main__":
     # Run tests directly
     pytest.main([__file__, "-v"])
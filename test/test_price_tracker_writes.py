@@ -0,0 +1,255 @@
+"""
+Test Price Tracker Write Paths
+Tests the bulk operations queued for price_history_permanent and price_timeline_raw
+"""
+
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.price_tracker import PriceTracker
+
+
+class TestPermanentTimelineWrites:
+    """Test the permanent timeline and raw history bulk writes"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.price_tracker = PriceTracker()
+        
+        # Mock MongoDB collections; bulk_write results report one upserted record
+        self.price_tracker.price_history_permanent_collection = AsyncMock()
+        self.price_tracker.price_history_permanent_collection.bulk_write.return_value = MagicMock(upserted_count=1, modified_count=0)
+        self.price_tracker.price_timeline_raw_collection = AsyncMock()
+        self.price_tracker.communitydata_collection = MagicMock()
+        
+        self.listing_id = "https://www.newhomesource.com/community/ca/ventura/sunset-village"
+        self.community = {
+            "community_id": "https://www.newhomesource.com/plan/plan-12-shea-homes-ventura-ca/3063205_Plan_12",
+            "name": "Plan 12",
+            "price": 500000,
+            "accommodationCategory": "Single Family Residence",
+            "address": {"addressLocality": "Ventura", "county": "Ventura County", "addressRegion": "CA"}
+        }
+        self.community_docs = {
+            self.listing_id: {
+                "listing_id": self.listing_id,
+                "community_data": {"communities": [self.community]}
+            }
+        }
+        self.permanent_id = PriceTracker.generate_permanent_id(self.community["community_id"])
+    
+    async def write_snapshot(self, last_entry, snapshot_date: datetime, price: float = 500000):
+        """Create a snapshot against a permanent record ending in last_entry and run the timeline update"""
+        permanent_records = {}
+        if last_entry:
+            permanent_records[self.permanent_id] = {"_id": self.permanent_id, "price_timeline": [last_entry]}
+        
+        community = {**self.community, "price": price}
+        snapshot = await self.price_tracker._create_price_snapshot(
+            community, self.listing_id, {}, permanent_records, snapshot_date
+        )
+        await self.price_tracker._update_permanent_timelines([snapshot], self.community_docs)
+    
+    def get_raw_ops(self):
+        """Collect the UpdateOne operations sent to price_timeline_raw"""
+        bulk_calls = self.price_tracker.price_timeline_raw_collection.bulk_write.call_args_list
+        return [op for call in bulk_calls for op in call[0][0]]
+    
+    def get_timeline_ops(self):
+        """Collect the UpdateOne operations sent to price_history_permanent"""
+        bulk_calls = self.price_tracker.price_history_permanent_collection.bulk_write.call_args_list
+        return [op for call in bulk_calls for op in call[0][0]]
+    
+    @pytest.mark.asyncio
+    async def test_timeline_upsert_payload(self):
+        """Test that each snapshot queues one unordered _id upsert carrying the timeline pipeline"""
+        await self.write_snapshot(None, datetime(2025, 1, 11, 14, 30))
+        
+        timeline_ops = self.get_timeline_ops()
+        assert len(timeline_ops) == 1
+        assert timeline_ops[0]._filter == {"_id": self.permanent_id}
+        assert timeline_ops[0]._upsert is True
+        
+        pipeline = timeline_ops[0]._doc
+        assert isinstance(pipeline, list)
+        assert pipeline[1]["$set"]["permanent_property_id"] == {"$literal": self.permanent_id}
+        assert pipeline[1]["$set"]["price_timeline"]["$cond"][2]["$concatArrays"][1]["$literal"][0]["price"] == 500000
+        
+        assert self.price_tracker.price_history_permanent_collection.bulk_write.call_args[1] == {"ordered": False}
+    
+    @pytest.mark.asyncio
+    async def test_raw_history_keyed_on_full_timestamp(self):
+        """Test that the raw history document is keyed by permanent ID and full snapshot timestamp"""
+        snapshot_date = datetime(2025, 1, 11, 14, 30, 5, 123000)
+        
+        await self.write_snapshot(None, snapshot_date)
+        
+        raw_ops = self.get_raw_ops()
+        assert len(raw_ops) == 1
+        assert raw_ops[0]._filter == {"_id": f"{self.permanent_id}_2025-01-11T14:30:05.123000"}
+        assert raw_ops[0]._upsert is True
+        
+        raw_doc = raw_ops[0]._doc["$setOnInsert"]
+        assert raw_doc["permanent_property_id"] == self.permanent_id
+        assert raw_doc["price"] == 500000
+        assert raw_doc["date"] == snapshot_date
+    
+    @pytest.mark.asyncio
+    async def test_same_day_rerun_at_same_price_skips_raw_history(self):
+        """Test that a same-day rerun at an unchanged price writes no raw history (the inline timeline skips it too)"""
+        last_entry = {"date": datetime(2025, 1, 11, 8, 0), "price": 500000}
+        
+        await self.write_snapshot(last_entry, datetime(2025, 1, 11, 20, 0))
+        
+        assert self.get_raw_ops() == []
+        assert len(self.get_timeline_ops()) == 1
+    
+    @pytest.mark.asyncio
+    async def test_price_returning_within_a_day_is_kept(self):
+        """Test that A→B→A within one day records the second A in raw history"""
+        last_entry = {"date": datetime(2025, 1, 11, 12, 0), "price": 525000}
+        
+        await self.write_snapshot(last_entry, datetime(2025, 1, 11, 20, 0), price=500000)
+        
+        raw_ops = self.get_raw_ops()
+        assert len(raw_ops) == 1
+        assert raw_ops[0]._doc["$setOnInsert"]["price"] == 500000
+    
+    @pytest.mark.asyncio
+    async def test_same_price_on_a_new_day_is_kept(self):
+        """Test that an unchanged price recorded on a previous day is written again"""
+        last_entry = {"date": datetime(2025, 1, 10, 20, 0), "price": 500000}
+        
+        await self.write_snapshot(last_entry, datetime(2025, 1, 11, 8, 0))
+        
+        assert len(self.get_raw_ops()) == 1
+    
+    @pytest.mark.asyncio
+    async def test_string_dated_last_entry_is_not_a_repeat(self):
+        """Test that legacy ISO-string dates never count as a same-day repeat"""
+        last_entry = {"date": "2025-01-11T08:00:00", "price": 500000}
+        
+        await self.write_snapshot(last_entry, datetime(2025, 1, 11, 20, 0))
+        
+        assert len(self.get_raw_ops()) == 1
+
+
+class TestTimelineUpdatePipeline:
+    """Test the pipeline update that appends a timeline entry and maintains running totals"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.price_tracker = PriceTracker()
+        self.now = datetime(2025, 1, 11, 20, 0)
+        self.timeline_entry = {"date": datetime(2025, 1, 11, 14, 30), "price": 500000, "currency": "USD"}
+        self.community_snapshot = {
+            "permanent_property_id": "abc123",
+            "community_name": "$Plan 12",  # Scraped text that looks like a field path
+            "listing_status": "active"
+        }
+    
+    def build(self, price: float = 500000):
+        """Build the pipeline for the sample snapshot at the given price"""
+        return self.price_tracker._build_timeline_update_pipeline(
+            self.community_snapshot, self.timeline_entry, price, self.now
+        )
+    
+    def get_totals(self, pipeline):
+        """The running-totals $cond inside the aggregated_metrics stage"""
+        return pipeline[2]["$set"]["aggregated_metrics"]["$let"]["vars"]["totals"]["$cond"]
+    
+    def test_stage_order_caps_after_totals(self):
+        """Test that totals are derived before the inline timeline is capped and the flag is removed"""
+        pipeline = self.build()
+        
+        assert [list(stage) for stage in pipeline] == [["$set"], ["$set"], ["$set"], ["$set"], ["$unset"]]
+        assert list(pipeline[0]["$set"]) == ["_repeat_snapshot"]
+        assert "aggregated_metrics" in pipeline[2]["$set"]
+        assert pipeline[3]["$set"] == {"price_timeline": {"$slice": ["$price_timeline", -PriceTracker.PRICE_TIMELINE_MAX_ENTRIES]}}
+        assert pipeline[4] == {"$unset": "_repeat_snapshot"}
+    
+    def test_repeat_flag_compares_last_entry_with_today(self):
+        """Test that a repeat is the last entry at the same price dated on or after today's midnight"""
+        repeat = self.build()[0]["$set"]["_repeat_snapshot"]["$let"]
+        
+        assert repeat["vars"] == {"last": {"$arrayElemAt": [{"$ifNull": ["$price_timeline", []]}, -1]}}
+        assert repeat["in"] == {"$and": [
+            {"$eq": ["$$last.price", 500000]},
+            {"$gte": ["$$last.date", datetime(2025, 1, 11)]}
+        ]}
+    
+    def test_repeat_skips_append(self):
+        """Test that the entry is appended as a literal unless the snapshot is a repeat"""
+        fields = self.build()[1]["$set"]
+        
+        assert fields["price_timeline"] == {"$cond": [
+            "$_repeat_snapshot",
+            "$price_timeline",
+            {"$concatArrays": [
+                {"$ifNull": ["$price_timeline", []]},
+                {"$literal": [self.timeline_entry]}
+            ]}
+        ]}
+    
+    def test_snapshot_fields_are_literal(self):
+        """Test that scraped values are wrapped in $literal and timestamps use the batch time"""
+        fields = self.build()[1]["$set"]
+        
+        assert fields["community_name"] == {"$literal": "$Plan 12"}
+        assert fields["permanent_property_id"] == {"$literal": "abc123"}
+        assert fields["last_updated"] == self.now
+        assert fields["created_at"] == {"$ifNull": ["$created_at", self.now]}
+    
+    def test_totals_derived_once_when_running_sum_missing(self):
+        """Test that records without running totals derive them from the positive timeline prices"""
+        condition, derived, _ = self.get_totals(self.build())
+        
+        assert condition == {"$eq": [{"$type": "$aggregated_metrics.running_sum"}, "missing"]}
+        assert derived["$let"]["vars"] == {"prices": {"$filter": {
+            "input": "$price_timeline.price", "cond": {"$gt": ["$$this", 0]}
+        }}}
+        assert derived["$let"]["in"] == {
+            "sum": {"$sum": "$$prices"},
+            "count": {"$size": "$$prices"},
+            "min": {"$min": "$$prices"},
+            "max": {"$max": "$$prices"}
+        }
+    
+    def test_totals_incremented_from_stored_running_sum(self):
+        """Test that stored totals are extended with the new price unless the snapshot is a repeat"""
+        _, _, incremental = self.get_totals(self.build())
+        new_price = {"$cond": ["$_repeat_snapshot", None, 500000]}
+        
+        assert incremental == {
+            "sum": {"$add": ["$aggregated_metrics.running_sum", {"$ifNull": [new_price, 0]}]},
+            "count": {"$add": ["$aggregated_metrics.total_days_tracked", {"$cond": [{"$eq": [new_price, None]}, 0, 1]}]},
+            "min": {"$min": ["$aggregated_metrics.min_price", new_price]},
+            "max": {"$max": ["$aggregated_metrics.max_price", new_price]}
+        }
+    
+    def test_non_positive_price_never_enters_totals(self):
+        """Test that a zero price is treated as no new price in the running totals"""
+        _, _, incremental = self.get_totals(self.build(price=0))
+        
+        assert incremental["min"] == {"$min": ["$aggregated_metrics.min_price", {"$cond": ["$_repeat_snapshot", None, None]}]}
+    
+    def test_metrics_read_from_totals(self):
+        """Test that the stored metrics come from the totals and the current price"""
+        metrics = self.build()[2]["$set"]["aggregated_metrics"]["$let"]["in"]["$let"]["in"]
+        
+        assert metrics["most_recent_price"] == 500000
+        assert metrics["average_price"] == {"$round": ["$$average_price", 2]}
+        assert metrics["min_price"] == "$$totals.min"
+        assert metrics["max_price"] == "$$totals.max"
+        assert metrics["total_days_tracked"] == "$$totals.count"
+        assert metrics["running_sum"] == "$$totals.sum"
+
+
+if __name__ == "__main__":
+    # Run tests directly
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,317 @@
+"""
+Test Stage One and Two Check
+Tests the special-community upserts and missing-listing archive written by the routing check
+"""
+
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, call, patch
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.stage_one_and_two_check import StageOneAndTwoCheck
+
+
+class MockCursor:
+    """Async cursor over a fixed list of documents"""
+    
+    def __init__(self, docs):
+        self.docs = docs
+    
+    def batch_size(self, size):
+        return self
+    
+    def __aiter__(self):
+        return self._iterate()
+    
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+    
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+
+class TestSpecialCommunityUpserts:
+    """Test the masterplan / basic community bulk upserts"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.checker = StageOneAndTwoCheck()
+        self.now = datetime(2025, 1, 11, 20, 0)
+        
+        # Mock MongoDB collections; each bulk_write reports one insert and one replacement
+        self.checker.homepagedata_collection = MagicMock()
+        self.checker.masterplandata_collection = AsyncMock()
+        self.checker.masterplandata_collection.bulk_write.return_value = MagicMock(upserted_count=1, matched_count=1)
+        self.checker.basiccommunitydata_collection = AsyncMock()
+        self.checker.basiccommunitydata_collection.bulk_write.return_value = MagicMock(upserted_count=1, matched_count=1)
+        
+        self.masterplan_doc = {
+            "listing_id": "https://www.newhomesource.com/masterplan/ca/riverside/oak-valley",
+            "community_kind": "masterplan",
+            "scraped_at": datetime(2025, 1, 11, 8, 0),
+            "source_url": "https://www.newhomesource.com/communities/ca/riverside-area",
+            "data_source": "stage1",
+            "listing_status": "active",
+            "property_data": {"name": "$Oak Valley", "price": 650000, "url": "https://www.newhomesource.com/masterplan/ca/riverside/oak-valley"}
+        }
+        self.basiccommunity_doc = {
+            "listing_id": "https://www.newhomesource.com/basiccommunity/ca/ventura/sea-breeze",
+            "community_kind": "basiccommunity",
+            "scraped_at": datetime(2025, 1, 11, 8, 0),
+            "source_url": "https://www.newhomesource.com/communities/ca/ventura-area",
+            "data_source": "stage1",
+            "listing_status": "updated",
+            "property_data": {"name": "Sea Breeze", "price": 820000}
+        }
+        self.regular_doc = {"listing_id": "https://www.newhomesource.com/community/ca/ventura/sunset-village"}
+    
+    def set_homepage_docs(self, special_docs, regular_docs):
+        """Return special_docs for the special-community scan and regular_docs for the regular id scan"""
+        def find(query, projection=None):
+            if query.get("community_kind") == "regular":
+                return MockCursor(regular_docs)
+            return MockCursor(special_docs)
+        
+        self.checker.homepagedata_collection.find = MagicMock(side_effect=find)
+    
+    def get_ops(self, collection):
+        """Collect the UpdateOne operations sent to a special collection"""
+        return [op for call in collection.bulk_write.call_args_list for op in call[0][0]]
+    
+    def test_replace_pipeline_carries_previous_scraped_at(self):
+        """Test that the replacement keeps the stored scraped_at as previous_scraped_at and wraps the document in $literal"""
+        new_doc = {"masterplanlisting_id": "abc", "scraped_at": self.now, "masterplan_data": {"name": "$Oak Valley"}}
+        
+        pipeline = self.checker._build_replace_pipeline(new_doc)
+        
+        assert pipeline == [{"$replaceWith": {"$mergeObjects": [
+            {"previous_scraped_at": "$scraped_at"},
+            {"$literal": new_doc}
+        ]}}]
+    
+    def test_masterplan_upsert_payload(self):
+        """Test that masterplans are upserted by masterplanlisting_id with the transformed document"""
+        op = self.checker._build_masterplan_upsert(self.masterplan_doc, self.now)
+        
+        assert op._filter == {"masterplanlisting_id": self.masterplan_doc["listing_id"]}
+        assert op._upsert is True
+        
+        masterplan_doc = op._doc[0]["$replaceWith"]["$mergeObjects"][1]["$literal"]
+        assert masterplan_doc == {
+            "masterplanlisting_id": self.masterplan_doc["listing_id"],
+            "scraped_at": self.masterplan_doc["scraped_at"],
+            "source_url": self.masterplan_doc["source_url"],
+            "masterplan_data": {"name": "$Oak Valley", "price_range": 650000, "url": self.masterplan_doc["property_data"]["url"]},
+            "data_source": "stage1",
+            "listing_status": "active",
+            "last_updated": self.now
+        }
+    
+    def test_basiccommunity_upsert_payload(self):
+        """Test that basic communities are upserted by basic_community_listing_id with property_data renamed"""
+        op = self.checker._build_basiccommunity_upsert(self.basiccommunity_doc, self.now)
+        
+        assert op._filter == {"basic_community_listing_id": self.basiccommunity_doc["listing_id"]}
+        assert op._upsert is True
+        
+        basiccommunity_doc = op._doc[0]["$replaceWith"]["$mergeObjects"][1]["$literal"]
+        assert basiccommunity_doc["basic_community_listing_id"] == self.basiccommunity_doc["listing_id"]
+        assert basiccommunity_doc["basic_community_data"] == self.basiccommunity_doc["property_data"]
+        assert basiccommunity_doc["listing_status"] == "updated"
+        assert basiccommunity_doc["last_updated"] == self.now
+    
+    @pytest.mark.asyncio
+    async def test_routing_writes_each_kind_to_its_collection(self):
+        """Test that special communities are bulk-upserted unordered and regular ids are returned for Stage 2"""
+        self.set_homepage_docs([self.masterplan_doc, self.basiccommunity_doc], [self.regular_doc])
+        
+        regular, masterplans, basiccommunities = await self.checker.process_stage_one_results()
+        
+        assert regular == [self.regular_doc["listing_id"]]
+        assert masterplans == [self.masterplan_doc["listing_id"]]
+        assert basiccommunities == [self.basiccommunity_doc["listing_id"]]
+        
+        masterplan_ops = self.get_ops(self.checker.masterplandata_collection)
+        basiccommunity_ops = self.get_ops(self.checker.basiccommunitydata_collection)
+        assert [op._filter for op in masterplan_ops] == [{"masterplanlisting_id": self.masterplan_doc["listing_id"]}]
+        assert [op._filter for op in basiccommunity_ops] == [{"basic_community_listing_id": self.basiccommunity_doc["listing_id"]}]
+        assert self.checker.masterplandata_collection.bulk_write.call_args[1] == {"ordered": False}
+    
+    @pytest.mark.asyncio
+    async def test_upserts_flushed_in_batches(self):
+        """Test that queued upserts are written every SPECIAL_WRITE_BATCH_SIZE documents"""
+        self.checker.SPECIAL_WRITE_BATCH_SIZE = 2
+        masterplan_docs = [
+            {**self.masterplan_doc, "listing_id": f"https://www.newhomesource.com/masterplan/{i}"}
+            for i in range(5)
+        ]
+        self.set_homepage_docs(masterplan_docs, [])
+        
+        await self.checker.process_stage_one_results()
+        
+        batch_sizes = [len(call[0][0]) for call in self.checker.masterplandata_collection.bulk_write.call_args_list]
+        assert batch_sizes == [2, 2, 1]
+        assert self.checker.basiccommunitydata_collection.bulk_write.call_count == 0
+    
+    @pytest.mark.asyncio
+    async def test_flush_counts_inserts_and_replacements(self):
+        """Test that upserted documents count as new and matched documents as updated"""
+        counts = {"new": 0, "updated": 0}
+        self.checker.masterplandata_collection.bulk_write.return_value = MagicMock(upserted_count=3, matched_count=2)
+        
+        await self.checker._flush_special_upserts(self.checker.masterplandata_collection, [MagicMock()], counts)
+        await self.checker._flush_special_upserts(self.checker.masterplandata_collection, [], counts)
+        
+        assert counts == {"new": 3, "updated": 2}
+        assert self.checker.masterplandata_collection.bulk_write.call_count == 1
+
+
+class TestMissingListingArchive:
+    """Test the server-side $merge archive of listings missing from today's Stage 1 scrape"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.checker = StageOneAndTwoCheck()
+        
+        # Mock MongoDB collections; aggregate() returns a cursor synchronously
+        self.checker.homepagedata_collection = MagicMock()
+        self.checker.homepagedata_collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+        self.checker.homepagedata_collection.delete_many = AsyncMock(return_value=MagicMock(deleted_count=2))
+        self.checker.homepagedata_archived_collection = MagicMock()
+        self.checker.homepagedata_archived_collection.name = "homepagedata_archived"
+        self.checker.homepagedata_archived_collection.database.name = "archived"
+        
+        self.current_ids = ["https://www.newhomesource.com/community/ca/ventura/sunset-village"]
+        self.missing_ids = [
+            "https://www.newhomesource.com/community/ca/riverside/old-orchard",
+            "https://www.newhomesource.com/community/ca/temecula/vine-ridge"
+        ]
+    
+    def set_scans(self, current_ids, previous_ids):
+        """Return current_ids for today's scan and previous_ids for the earlier active scan"""
+        def find(query, projection=None):
+            if "$gte" in query.get("scraped_at", {}):
+                return MockCursor([{"listing_id": listing_id} for listing_id in current_ids])
+            return MockCursor([{"listing_id": listing_id} for listing_id in previous_ids])
+        
+        self.checker.homepagedata_collection.find = MagicMock(side_effect=find)
+    
+    @pytest.mark.asyncio
+    async def test_missing_listings_merged_then_deleted(self):
+        """Test that missing listings are copied with one $merge and removed with one delete_many"""
+        self.set_scans(self.current_ids, self.current_ids + self.missing_ids)
+        
+        await self.checker.handle_missing_stage1_listings()
+        
+        pipeline = self.checker.homepagedata_collection.aggregate.call_args[0][0]
+        assert len(pipeline) == 3
+        assert sorted(pipeline[0]["$match"]["listing_id"]["$in"]) == sorted(self.missing_ids)
+        
+        archive_fields = pipeline[1]["$set"]
+        assert archive_fields["listing_status"] == "archived"
+        assert archive_fields["archive_reason"] == "missing from current Stage 1 scrape"
+        assert isinstance(archive_fields["archived_at"], datetime)
+        
+        assert pipeline[2] == {"$merge": {
+            "into": {"db": "archived", "coll": "homepagedata_archived"},
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+        
+        delete_filter = self.checker.homepagedata_collection.delete_many.call_args[0][0]
+        assert sorted(delete_filter["listing_id"]["$in"]) == sorted(self.missing_ids)
+    
+    @pytest.mark.asyncio
+    async def test_scans_use_datetime_bounds(self):
+        """Test that today's scan and the previous scan are bounded by datetimes, not ISO strings"""
+        self.set_scans(self.current_ids, self.current_ids)
+        
+        await self.checker.handle_missing_stage1_listings()
+        
+        current_query, previous_query = [call[0][0] for call in self.checker.homepagedata_collection.find.call_args_list]
+        today_start = current_query["scraped_at"]["$gte"]
+        assert isinstance(today_start, datetime)
+        assert today_start == datetime.combine(today_start.date(), datetime.min.time())
+        assert (current_query["scraped_at"]["$lt"] - today_start).days == 1
+        assert previous_query["scraped_at"] == {"$lt": today_start}
+        assert previous_query["listing_status"] == {"$in": ["active", "new", "updated"]}
+    
+    @pytest.mark.asyncio
+    async def test_nothing_archived_without_a_scrape_today(self):
+        """Test that no listing is archived when Stage 1 scraped nothing today"""
+        self.set_scans([], self.missing_ids)
+        
+        await self.checker.handle_missing_stage1_listings()
+        
+        self.checker.homepagedata_collection.aggregate.assert_not_called()
+        self.checker.homepagedata_collection.delete_many.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_nothing_archived_when_no_listing_is_missing(self):
+        """Test that no archive round-trips are made when every previous listing was scraped today"""
+        self.set_scans(self.current_ids, self.current_ids)
+        
+        await self.checker.handle_missing_stage1_listings()
+        
+        self.checker.homepagedata_collection.aggregate.assert_not_called()
+        self.checker.homepagedata_collection.delete_many.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_failed_merge_keeps_listings(self):
+        """Test that listings are not deleted when the $merge copy fails"""
+        self.set_scans(self.current_ids, self.current_ids + self.missing_ids)
+        self.checker.homepagedata_collection.aggregate.return_value.to_list = AsyncMock(side_effect=Exception("merge failed"))
+        
+        await self.checker.handle_missing_stage1_listings()
+        
+        self.checker.homepagedata_collection.delete_many.assert_not_called()
+
+
+class TestHomepageIndexes:
+    """Test the homepagedata indexes created on connect"""
+    
+    def setup_method(self):
+        """Setup test environment"""
+        self.checker = StageOneAndTwoCheck()
+        self.homepagedata_collection = MagicMock()
+        self.homepagedata_collection.create_index = AsyncMock()
+        
+        # Every collection lookup returns an index-accepting mock; homepagedata gets its own
+        db = MagicMock()
+        db.__getitem__.side_effect = lambda name: self.homepagedata_collection if name == "homepagedata" else MagicMock(create_index=AsyncMock())
+        db.get_collection.return_value.create_index = AsyncMock()
+        self.client = MagicMock()
+        self.client.__getitem__.return_value = db
+    
+    async def connect(self):
+        """Run connect_to_mongodb against the mocked client"""
+        with patch("shared.stage_one_and_two_check.AsyncIOMotorClient", return_value=self.client):
+            return await self.checker.connect_to_mongodb()
+    
+    @pytest.mark.asyncio
+    async def test_listing_id_indexed_unique(self):
+        """Test that listing_id gets a unique single-field index alongside the two scan indexes"""
+        assert await self.connect() is True
+        
+        assert self.homepagedata_collection.create_index.call_args_list == [
+            call([("community_kind", 1), ("listing_status", 1), ("listing_id", 1)]),
+            call([("scraped_at", 1), ("listing_status", 1), ("listing_id", 1)]),
+            call([("listing_id", 1)], unique=True)
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_duplicate_listing_ids_fall_back_to_non_unique(self):
+        """Test that a failed unique build still leaves listing_id indexed and the connection usable"""
+        self.homepagedata_collection.create_index.side_effect = [None, None, Exception("E11000 duplicate key"), None]
+        
+        assert await self.connect() is True
+        assert self.homepagedata_collection.create_index.call_args_list[-1] == call([("listing_id", 1)])
+
+
+if __name__ == "__main__":
+    # Run tests directly
+    pytest.main([__file__, "-v"])